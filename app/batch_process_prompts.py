@@ -10,6 +10,8 @@ import argparse
 import concurrent.futures
 import threading
 
+from citations import build_source_index
+
 def show_usage():
     """使用方法を表示する"""
     print(f"使い方: {sys.argv[0]} /path/to/prompt/directory [出力ディレクトリのベースパス]")
@@ -40,6 +42,69 @@ def process_prompt_file(prompt_file, output_dir):
         print("----------------------------------------")
         return False
 
+def process_prompt_text(name, prompt_text, output_dir, conversation_url=None):
+    """ファイルを作らずにプロンプト文字列を標準入力で渡して処理する関数
+
+    conversation_url を指定すると、新しい会話ではなくその会話の続きとして送信する。
+    """
+    print(f"処理開始: {name}")
+
+    cmd = [
+        'python',
+        'run_DeepResearch.py',
+        '--prompt_path', '-',
+        '--name', name,
+        '--output_dir', str(output_dir)
+    ]
+    if conversation_url:
+        cmd += ['--conversation_url', conversation_url]
+
+    try:
+        subprocess.run(cmd, input=prompt_text.encode('utf-8'), check=True)
+        print(f"処理完了: {name}")
+        print("----------------------------------------")
+        return True
+    except subprocess.CalledProcessError as e:
+        print(f"エラー: {name} の処理中にエラーが発生しました")
+        print(f"詳細: {e}")
+        print("----------------------------------------")
+        return False
+
+def run_streaming(jobs, worker, max_workers, interval, on_done=None):
+    """イテレータからジョブを必要な分だけ取り出して並列実行する
+
+    実行中のジョブは最大 max_workers 個で、ジョブ総数に関わらずメモリ使用量は一定。
+    ジョブの起動は interval 秒以上の間隔を空け、完了するたびに on_done(job, result) を呼ぶ。
+    """
+    jobs = iter(jobs)
+    in_flight = {}
+    last_start = None
+    exhausted = False
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < max_workers:
+                job = next(jobs, None)
+                if job is None:
+                    exhausted = True
+                    break
+                # インターバルを空ける（最初のジョブ以外）
+                if last_start is not None:
+                    time.sleep(max(0, last_start + interval - time.time()))
+                last_start = time.time()
+                in_flight[executor.submit(worker, job)] = job
+            if not in_flight:
+                break
+            done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                job = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"エラー: ジョブの実行中に例外が発生しました: {e}")
+                    result = False
+                if on_done is not None:
+                    on_done(job, result)
+
 def main():
     # 引数解析
     parser = argparse.ArgumentParser(description='指定ディレクトリ内の全txtファイルに対してDeepResearchを実行')
@@ -82,28 +147,16 @@ def main():
         print("警告: .txtファイルが見つかりません")
         sys.exit(0)
     
-    # 結果を保存するリスト
-    results = []
     success_count = 0
-    
-    # ThreadPoolExecutorを使用して並列実行
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = []
-        
-        # ファイルごとに処理を提出し、間隔を空けて実行
-        for i, prompt_file in enumerate(txt_files):
-            # 新しいタスクを提出
-            future = executor.submit(process_prompt_file, prompt_file, output_dir)
-            futures.append(future)
-            
-            # インターバルを空ける（最後のファイル以外）
-            if i < len(txt_files) - 1:
-                time.sleep(interval)
-        
-        # すべてのタスクの完了を待つ
-        for future in concurrent.futures.as_completed(futures):
-            if future.result():
-                success_count += 1
+
+    def on_done(prompt_file, ok):
+        nonlocal success_count
+        if ok:
+            success_count += 1
+
+    # ファイルごとに処理を提出し、間隔を空けて並列実行
+    run_streaming(txt_files, lambda prompt_file: process_prompt_file(prompt_file, output_dir),
+                  max_workers, interval, on_done)
     
     # 結果の表示
     if success_count == 0:
@@ -111,6 +164,9 @@ def main():
     else:
         print(f"すべての処理が完了しました。合計 {len(txt_files)} 個中 {success_count} 個のファイルの処理に成功しました。")
         print(f"結果は {output_dir} に保存されています")
+        # 引用ソースの横断インデックスを更新
+        index, _ = build_source_index(output_base_dir)
+        print(f"引用ソースインデックスを更新しました: {index['source_count']} 件のソース")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""浏览器崩溃/卡死看门狗：监测浏览器进程、renderer 崩溃事件、CDP 连接和 evaluate 延迟，异常时重启浏览器并从已保存的会话 URL 恢复"""
+
+import asyncio
+import time
+
+import nodriver as uc
+from nodriver.cdp import browser as cdp_browser
+from nodriver.cdp import inspector as cdp_inspector
+
+from cdp_session import close_session_client
+
+
+class BrowserFailure(Exception):
+    """浏览器已崩溃或无响应，需要重启"""
+
+    def __init__(self, reason):
+        self.reason = reason
+        super().__init__(reason)
+
+
+class BrowserWatchdog:
+    def __init__(self, browser, tab, config):
+        settings = config.get('watchdog', {})
+        self.browser = browser
+        self.tab = tab
+        self.probe_timeout = settings.get('probe_timeout', 15)
+        self.probe_interval = settings.get('probe_interval', 30)
+        self.max_latency = settings.get('max_latency', 10)
+        self.max_slow_probes = settings.get('max_slow_probes', 3)
+        # 按等待循环的轮数调度主动探测（而不是按墙钟时间），录制回放时探测出现在相同位置
+        self.every = max(1, round(self.probe_interval / config['timings']['button_check_interval']))
+        self.crashed = None
+        self.last_latency = None
+        self.slow_probes = 0
+        self._ticks = 0
+
+    async def start(self):
+        """注册崩溃事件 handler 并启用 Inspector 域"""
+        self.tab.add_handler(cdp_inspector.TargetCrashed, self._on_target_crashed)
+        self.tab.add_handler(cdp_inspector.Detached, self._on_detached)
+        try:
+            await self.tab.send(cdp_inspector.enable())
+        except Exception as e:
+            print(f"⚠️ Inspector.enable 失败: {e}")
+        return self
+
+    def _on_target_crashed(self, event):
+        self.crashed = "renderer crashed (Inspector.targetCrashed)"
+
+    def _on_detached(self, event):
+        self.crashed = f"inspector detached: {event.reason}"
+
+    def _process_exited(self):
+        process = getattr(self.browser, "_process", None)
+        return process is not None and getattr(process, "returncode", None) is not None
+
+    async def check(self):
+        """返回故障原因，正常时返回 None"""
+        if self.crashed:
+            return self.crashed
+        if self._process_exited():
+            return "browser process exited"
+        if getattr(self.tab, "closed", False):
+            return "CDP websocket closed"
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(self.tab.evaluate("1"), timeout=self.probe_timeout)
+        except asyncio.TimeoutError:
+            return f"renderer hang (evaluate > {self.probe_timeout}s)"
+        except (ConnectionError, OSError) as e:
+            return f"CDP connection lost: {e!r}"
+        except Exception as e:
+            if "closed" in str(e).lower():
+                return f"CDP connection lost: {e!r}"
+            # 其它错误（页面正在导航等）不视为浏览器故障
+            return None
+        self.last_latency = time.monotonic() - start
+        if self.last_latency <= self.max_latency:
+            self.slow_probes = 0
+            return None
+        # 偶发的高延迟只告警；连续 max_slow_probes 次都超过 max_latency 视为 renderer 已无法正常工作
+        self.slow_probes += 1
+        print(f"⚠️ evaluate 延迟过高: {self.last_latency:.1f}s ({self.slow_probes}/{self.max_slow_probes})")
+        if self.slow_probes >= self.max_slow_probes:
+            return f"renderer unresponsive (evaluate > {self.max_latency}s for {self.slow_probes} probes)"
+        return None
+
+    async def raise_if_failed(self, force=False):
+        """崩溃标志立即生效；主动探测每 every 次调用（约 probe_interval 秒）一次，force 时立即探测"""
+        if self.crashed:
+            raise BrowserFailure(self.crashed)
+        self._ticks += 1
+        if not force and self._ticks % self.every:
+            return
+        reason = await self.check()
+        if reason:
+            raise BrowserFailure(reason)
+
+
+async def browser_alive(browser, timeout=15):
+    """浏览器进程仍在运行且浏览器级 CDP 连接可用。单个 tab 的 renderer 崩溃/卡死不影响这两者，
+    此时只需重开该 tab，不必重启整个浏览器"""
+    if browser is None:
+        return False
+    process = getattr(browser, "_process", None)
+    if process is not None and process.returncode is not None:
+        return False
+    try:
+        await asyncio.wait_for(browser.connection.send(cdp_browser.get_version()), timeout=timeout)
+    except Exception:
+        return False
+    return True
+
+
+async def restart_browser(browser, tab, config, url):
+    """停止旧浏览器（忽略错误），启动新浏览器并打开已保存的会话 URL，返回 (browser, tab)"""
+    try:
+        await close_session_client(tab)
+    except Exception:
+        pass
+    try:
+        browser.stop()
+    except Exception:
+        pass
+    await asyncio.sleep(3)
+    browser = await uc.start(headless=config['browser']['headless'])
+    await browser.cookies.load()
+    tab = await browser.get(url)
+    await tab.maximize()
+    await tab.sleep(config['timings']['initial_wait'])
+    return browser, tab
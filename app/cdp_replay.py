@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""CDP 流量录制与确定性回放：录制一次真实运行的全部 CDP 命令/响应/事件（以及下载目录中出现的文件），
+离线回放以统计往返次数和纯 Python 开销"""
+
+import argparse
+import asyncio
+import json
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from unittest import mock
+
+from nodriver.cdp import util as cdp_util
+
+from cdp_session import CDPError
+
+
+class ReplayMismatch(Exception):
+    """回放时代码发出了录制中不存在的命令（控制流与录制时不一致）"""
+
+
+class ReplayedProtocolError(Exception):
+    """录制时该命令返回了 CDP 错误，回放时原样抛出"""
+
+
+def _raw_command(request):
+    """把已展开的请求包装成 nodriver 可发送的命令生成器，返回未解析的原始 result"""
+    result = yield request
+    return result
+
+
+def _finish(cdp_obj, raw):
+    """把原始 result 交给原命令生成器解析，得到与直接 send 相同的返回值"""
+    try:
+        cdp_obj.send(raw)
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError("CDP 命令生成器未正常结束")
+
+
+class CDPRecorder:
+    """把 tab 上的 CDP 命令、iframe session 命令、事件和 tab.sleep 写入紧凑的 JSONL 日志。
+    指定 download_dir 时，每次 tab.sleep 结束后把下载目录中新出现（或内容变化）的 .md 文件也写入日志：
+    run_DeepResearch 只在 sleep 之后检查下载目录，回放时在同一位置还原这些文件"""
+
+    def __init__(self, path, download_dir=None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self.path.open("w", encoding="utf-8")
+        self._start = time.perf_counter()
+        self._restore = []
+        self._original_parse = None
+        self.download_dir = Path(download_dir) if download_dir else None
+        self._downloads = self._scan_downloads()
+
+    def _scan_downloads(self):
+        if self.download_dir is None or not self.download_dir.is_dir():
+            return {}
+        stamps = {}
+        for path in self.download_dir.glob("*.md"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            stamps[path.name] = (st.st_mtime_ns, st.st_size)
+        return stamps
+
+    def _record_downloads(self):
+        current = self._scan_downloads()
+        for name, stamp in sorted(current.items()):
+            if self._downloads.get(name) == stamp:
+                continue
+            try:
+                content = (self.download_dir / name).read_text(encoding="utf-8", errors="replace")
+            except OSError:
+                continue
+            self._write({"k": "file", "n": name, "c": content})
+        self._downloads = current
+
+    def _write(self, entry):
+        entry["t"] = round(time.perf_counter() - self._start, 4)
+        self._file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def attach(self, tab):
+        original_send = tab.send
+        original_sleep = tab.sleep
+        # 浏览器重启后会对新 tab 再次 attach，全局的事件解析函数只包装一次
+        first_attach = self._original_parse is None
+        if first_attach:
+            self._original_parse = cdp_util.parse_json_event
+        original_parse = self._original_parse
+
+        async def send(cdp_obj, *args, **kwargs):
+            # nodriver 内部的 target 状态刷新不属于业务控制流
+            if kwargs.get("_is_update"):
+                return await original_send(cdp_obj, *args, **kwargs)
+            request = next(cdp_obj)
+            entry = {"k": "cmd", "m": request["method"], "p": request.get("params")}
+            t0 = time.perf_counter()
+            try:
+                raw = await original_send(_raw_command(request), *args, **kwargs)
+            except Exception as e:
+                entry.update(e=str(e), d=round(time.perf_counter() - t0, 4))
+                self._write(entry)
+                raise
+            entry.update(r=raw, d=round(time.perf_counter() - t0, 4))
+            self._write(entry)
+            return _finish(cdp_obj, raw)
+
+        async def sleep(t=1):
+            self._write({"k": "sleep", "v": t})
+            result = await original_sleep(t)
+            self._record_downloads()
+            return result
+
+        async def session_hook(raw_send, tab_, session_id, method, params):
+            entry = {"k": "cmd", "m": method, "p": params, "s": session_id and str(session_id)}
+            t0 = time.perf_counter()
+            try:
+                result = await raw_send(tab_, session_id, method, params)
+            except CDPError as e:
+                entry.update(e=e.error, d=round(time.perf_counter() - t0, 4))
+                self._write(entry)
+                raise
+            entry.update(r=result, d=round(time.perf_counter() - t0, 4))
+            self._write(entry)
+            return result
+
+        def event_hook(method, params, session_id):
+            # c=1 标记来自 CDPSessionClient 连接的事件，回放时送回客户端的订阅者
+            self._write({"k": "evt", "m": method, "p": params, "s": session_id, "c": 1})
+
+        def parse_json_event(message):
+            self._write({"k": "evt", "m": message.get("method"), "p": message.get("params"),
+                         "s": message.get("sessionId")})
+            return original_parse(message)
+
+        tab.send = send
+        tab.sleep = sleep
+        tab.cdp_session_hook = session_hook
+        tab.cdp_event_hook = event_hook
+        if first_attach:
+            cdp_util.parse_json_event = parse_json_event
+            self._restore.append(lambda: setattr(cdp_util, "parse_json_event", original_parse))
+        print(f"🎙️ CDP 录制中: {self.path}")
+        return tab
+
+    def close(self):
+        for restore in reversed(self._restore):
+            restore()
+        self._restore.clear()
+        self._original_parse = None
+        if not self._file.closed:
+            self._file.close()
+
+
+def _normalize(params):
+    """经过一次 JSON 往返，使实际发出的参数与日志中的参数可直接比较（tuple/list 等差异）"""
+    return json.loads(json.dumps(params or {}, ensure_ascii=False))
+
+
+def load_log(path):
+    with Path(path).open("r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(entries):
+    """统计一段录制/回放的命令数、session 命令数、事件数和 sleep 总时长"""
+    commands = [e for e in entries if e["k"] == "cmd"]
+    sleeps = [e["v"] for e in entries if e["k"] == "sleep"]
+    return {
+        "commands": len(commands),
+        "session_commands": sum(1 for e in commands if e.get("s")),
+        "events": sum(1 for e in entries if e["k"] == "evt"),
+        "sleeps": len(sleeps),
+        "sleep_seconds": round(sum(sleeps), 3),
+        "downloads": sum(1 for e in entries if e["k"] == "file"),
+        "cdp_seconds": round(sum(e.get("d", 0) for e in commands), 3),
+        "by_method": dict(Counter(e["m"] for e in commands).most_common()),
+    }
+
+
+class CDPReplayer:
+    """按录制顺序回放响应；未被消费的录制命令计入 unconsumed_commands，多出的命令抛出 ReplayMismatch。
+    录制中的下载文件在对应的 tab.sleep 之后写入 download_dir"""
+
+    def __init__(self, path, strict=False, download_dir=None):
+        self.entries = load_log(path)
+        self.strict = strict
+        self.download_dir = Path(download_dir) if download_dir else None
+        self.pos = 0
+        self.consumed = set()
+        self.issued = []
+        self.tab = None
+        # 最后消费的命令和最后对齐的 sleep 在日志中的位置，用于把回放中的 sleep 对应到录制中的 sleep
+        self._last_cmd = -1
+        self._sleep_cursor = 0
+
+    def _take(self, method, session_id, params=None):
+        """取出第一条尚未消费、method / session / params 都一致的命令（并发命令的完成顺序可能与发出顺序不同），
+        以及它之前尚未分发的事件"""
+        params = _normalize(params)
+        pending_events = []
+        for i in range(self.pos, len(self.entries)):
+            entry = self.entries[i]
+            if i in self.consumed or entry["k"] in ("sleep", "file"):
+                continue
+            if entry["k"] == "evt":
+                pending_events.append(i)
+                continue
+            if entry["m"] == method and entry.get("s") == session_id and _normalize(entry.get("p")) == params:
+                self.consumed.update(pending_events)
+                self.consumed.add(i)
+                self._last_cmd = max(self._last_cmd, i)
+                while self.pos < len(self.entries) and (
+                        self.pos in self.consumed or self.entries[self.pos]["k"] in ("sleep", "file")):
+                    self.pos += 1
+                return entry, [self.entries[j] for j in pending_events]
+            if self.strict:
+                break
+        raise ReplayMismatch(f"录制中第 {self.pos} 条之后没有匹配的命令: {method} (session={session_id}, "
+                             f"params={json.dumps(params, ensure_ascii=False)[:200]})")
+
+    def _dispatch(self, events):
+        """把两条命令之间录制到的事件交给 tab 上注册的 handler，与 nodriver 的分发方式一致"""
+        handlers = getattr(self.tab, "handlers", None) or {}
+        for raw in events:
+            self.issued.append(raw)
+            if raw.get("c"):
+                client = getattr(self.tab, "cdp_session_client", None)
+                if client is not None:
+                    client._dispatch_event(raw["m"], raw["p"] or {}, raw["s"])
+                continue
+            try:
+                event = cdp_util.parse_json_event({"method": raw["m"], "params": raw["p"]})
+            except KeyError:
+                continue
+            for callback in list(handlers.get(type(event), [])):
+                try:
+                    result = callback(event, self.tab)
+                except TypeError:
+                    result = callback(event)
+                if asyncio.iscoroutine(result):
+                    asyncio.ensure_future(result)
+
+    async def send(self, cdp_obj):
+        request = next(cdp_obj)
+        entry, events = self._take(request["method"], None, request.get("params"))
+        self._dispatch(events)
+        self.issued.append({"k": "cmd", "m": request["method"]})
+        await asyncio.sleep(0)
+        if "e" in entry:
+            raise ReplayedProtocolError(entry["e"])
+        return _finish(cdp_obj, entry.get("r"))
+
+    async def session_send(self, raw_send, tab, session_id, method, params):
+        session_id = session_id and str(session_id)
+        entry, events = self._take(method, session_id, params)
+        self._dispatch(events)
+        self.issued.append({"k": "cmd", "m": method, "s": session_id})
+        await asyncio.sleep(0)
+        if "e" in entry:
+            raise CDPError(method, entry["e"])
+        return entry.get("r")
+
+    async def sleep(self, t=1):
+        self.issued.append({"k": "sleep", "v": t})
+        self._restore_downloads()
+        await asyncio.sleep(0)
+
+    def _restore_downloads(self):
+        """把本次 sleep 对应到录制中最后消费的命令之后的下一个 sleep，还原录制时紧随其后出现的下载文件"""
+        start = max(self._sleep_cursor, self._last_cmd + 1)
+        index = next((i for i in range(start, len(self.entries)) if self.entries[i]["k"] == "sleep"), None)
+        if index is None:
+            return
+        self._sleep_cursor = index + 1
+        for entry in self.entries[index + 1:]:
+            if entry["k"] == "evt":
+                continue
+            if entry["k"] != "file":
+                break
+            if self.download_dir is None:
+                raise ReplayMismatch(f"录制中有下载文件 {entry['n']}，但回放没有指定 download_dir")
+            self.download_dir.mkdir(parents=True, exist_ok=True)
+            (self.download_dir / Path(entry["n"]).name).write_text(entry["c"], encoding="utf-8")
+            self.issued.append({"k": "file", "n": entry["n"]})
+
+    def make_tab(self):
+        """构造一个不连接浏览器的 nodriver Tab，所有 CDP 流量都由录制日志应答"""
+        import nodriver as uc
+        replayer = self
+
+        class ReplayTab(uc.Tab):
+            async def send(self, cdp_obj, *args, **kwargs):
+                return await replayer.send(cdp_obj)
+
+            async def sleep(self, t=1):
+                await replayer.sleep(t)
+
+            def __await__(self):
+                return asyncio.sleep(0).__await__()
+
+        tab = ReplayTab.__new__(ReplayTab)
+        uc.Tab.__init__(tab, websocket_url="ws://replay", target=None, browser=None)
+        tab.cdp_session_hook = self.session_send
+        self.tab = tab
+        return tab
+
+    def make_browser(self):
+        return _ReplayBrowser(self.make_tab())
+
+    def report(self, wall_seconds):
+        remaining = sum(1 for i, e in enumerate(self.entries) if e["k"] == "cmd" and i not in self.consumed)
+        return {
+            "recorded": summarize(self.entries),
+            "replayed": summarize(self.issued),
+            "unconsumed_commands": remaining,
+            "python_seconds": round(wall_seconds, 4),
+        }
+
+
+class _ReplayCookies:
+    async def load(self, *args, **kwargs):
+        pass
+
+    async def save(self, *args, **kwargs):
+        pass
+
+
+class _ReplayBrowser:
+    def __init__(self, tab):
+        self.main_tab = tab
+        self.cookies = _ReplayCookies()
+
+    async def get(self, url="about:blank", new_tab=False, new_window=False):
+        return self.main_tab
+
+    def stop(self):
+        pass
+
+
+async def replay_main(log_path, config_path="config.yaml", prompt_path=None, output_dir=None, strict=False,
+                      prompt_text=None, name=None, conversation_url=None):
+    """在回放浏览器上运行完整的 run_DeepResearch.main，返回统计报告；
+    prompt_text / name / conversation_url 与录制时传给 run_DeepResearch 的参数一致。
+    下载目录使用独立的临时目录，录制中的下载文件还原到这里，不影响真实的下载目录"""
+    import run_DeepResearch
+
+    download_dir = tempfile.mkdtemp(prefix="cdp_replay_downloads_")
+    replayer = CDPReplayer(log_path, strict=strict, download_dir=download_dir)
+    output_dir = output_dir or tempfile.mkdtemp(prefix="cdp_replay_")
+
+    async def start(*args, **kwargs):
+        return replayer.make_browser()
+
+    start_time = time.perf_counter()
+    try:
+        with mock.patch.object(run_DeepResearch.uc, "start", start):
+            await run_DeepResearch.main(config_path=config_path, prompt_path=prompt_path, output_dir=output_dir,
+                                        prompt_text=prompt_text, name=name, conversation_url=conversation_url,
+                                        index=False, download_dir=download_dir)
+    finally:
+        shutil.rmtree(download_dir, ignore_errors=True)
+    return replayer.report(time.perf_counter() - start_time)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='CDP 录制日志的统计与离线回放')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_summary = sub.add_parser('summary', help='统计录制日志')
+    p_summary.add_argument('log', help='录制日志路径 (run_DeepResearch.py --record_cdp 生成)')
+
+    p_replay = sub.add_parser('replay', help='不启动浏览器，回放完整的 run_DeepResearch.main')
+    p_replay.add_argument('log', help='录制日志路径')
+    p_replay.add_argument('--config', type=str, default='config.yaml',
+                          help='配置文件路径 (默认: config.yaml)')
+    p_replay.add_argument('--prompt_path', type=str, required=True,
+                          help='录制时使用的提示文件；为 "-" 时从标准输入读取')
+    p_replay.add_argument('--name', type=str, default=None,
+                          help='录制时的 --name')
+    p_replay.add_argument('--conversation_url', type=str, default=None,
+                          help='录制时的 --conversation_url')
+    p_replay.add_argument('--strict', action='store_true',
+                          help='命令顺序必须与录制完全一致')
+    p_replay.add_argument('--max-commands', type=int, default=None,
+                          help='回放命令数上限，超出时以非零状态退出')
+    p_replay.add_argument('--max-sleep', type=float, default=None,
+                          help='回放中 tab.sleep 总秒数上限，超出时以非零状态退出')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.command == 'summary':
+        print(json.dumps(summarize(load_log(args.log)), ensure_ascii=False, indent=2))
+        return
+
+    import nodriver as uc
+    prompt_path, prompt_text = args.prompt_path, None
+    if prompt_path == '-':
+        prompt_path, prompt_text = None, sys.stdin.buffer.read().decode('utf-8')
+    try:
+        report = uc.loop().run_until_complete(
+            replay_main(args.log, config_path=args.config, prompt_path=prompt_path, strict=args.strict,
+                        prompt_text=prompt_text, name=args.name, conversation_url=args.conversation_url))
+    except ReplayMismatch as e:
+        print(f"❌ 回放失败: {e}")
+        sys.exit(2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    replayed = report["replayed"]
+    failed = False
+    if args.max_commands is not None and replayed["commands"] > args.max_commands:
+        print(f"❌ CDP 命令数 {replayed['commands']} 超过上限 {args.max_commands}")
+        failed = True
+    if args.max_sleep is not None and replayed["sleep_seconds"] > args.max_sleep:
+        print(f"❌ sleep 总时长 {replayed['sleep_seconds']}s 超过上限 {args.max_sleep}s")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""嵌套 iframe 的 CDP 会话客户端：在独立 websocket 上多路复用 flatten 子会话，支持并发命令、单次超时、事件订阅、会话复用与 detach"""
+
+import asyncio
+import itertools
+import json
+
+import websockets
+from nodriver.cdp import page as cdp_page
+from nodriver.cdp import target as cdp_target
+
+
+class CDPError(Exception):
+    """CDP 命令返回了 error"""
+
+    def __init__(self, method, error):
+        self.method = method
+        self.error = error
+        super().__init__(f"{method}: {error}")
+
+
+class ChildSession:
+    """一个已 attach 的子 target（flatten 模式下以 sessionId 区分）"""
+
+    def __init__(self, client, target_id, session_id):
+        self.client = client
+        self.target_id = target_id
+        self.session_id = session_id
+        self.attached = True
+        self._worlds = {}
+        # 框架导航或上下文被清空后，缓存的 isolated world 失效
+        self.on("Page.frameNavigated", self._on_frame_navigated)
+        self.on("Runtime.executionContextsCleared", lambda params: self._worlds.clear())
+
+    async def send(self, method, params=None, timeout=None):
+        return await self.client.send(method, params, session_id=self.session_id, timeout=timeout)
+
+    def on(self, method, callback):
+        """订阅本会话的事件，callback(params) 可为普通函数或协程函数；返回取消订阅的函数"""
+        return self.client.subscribe(method, callback, session_id=self.session_id)
+
+    def _on_frame_navigated(self, params):
+        frame_id = (params.get("frame") or {}).get("id")
+        for key in [k for k in self._worlds if k[0] == frame_id]:
+            self._worlds.pop(key, None)
+
+    async def isolated_world(self, frame_id, world_name="extract_content", timeout=None):
+        """在指定 frame 中创建（或复用已创建的）isolated world，返回 executionContextId"""
+        key = (frame_id, world_name)
+        if key not in self._worlds:
+            result = await self.send("Page.createIsolatedWorld",
+                                     {"frameId": frame_id, "worldName": world_name}, timeout=timeout)
+            self._worlds[key] = result.get("executionContextId")
+        return self._worlds[key]
+
+    async def detach(self, timeout=None):
+        if not self.attached:
+            return
+        self.attached = False
+        self.client._forget(self)
+        try:
+            await self.client.send("Target.detachFromTarget", {"sessionId": self.session_id}, timeout=timeout)
+        except (CDPError, asyncio.TimeoutError, ConnectionError):
+            pass
+
+
+class CDPSessionClient:
+    """挂在 tab 上的长生命周期客户端；命令 id、响应和事件都由自己的 websocket 读循环处理，不依赖 nodriver 内部结构"""
+
+    def __init__(self, tab, default_timeout=15):
+        self.tab = tab
+        self.websocket_url = tab.websocket_url
+        self.default_timeout = default_timeout
+        self._ws = None
+        self._reader = None
+        self._connect_lock = asyncio.Lock()
+        self._send_lock = asyncio.Lock()
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._subscribers = {}
+        self._sessions = {}
+        self._attaching = {}
+        self.subscribe("Target.detachedFromTarget", self._on_detached)
+
+    async def _ensure_connected(self):
+        async with self._connect_lock:
+            if self._ws is None:
+                self._ws = await websockets.connect(self.websocket_url, max_size=None)
+                self._reader = asyncio.ensure_future(self._read_loop(self._ws))
+        return self._ws
+
+    async def _read_loop(self, ws):
+        try:
+            async for raw in ws:
+                message = json.loads(raw)
+                if "id" in message:
+                    future = self._pending.pop(message["id"], None)
+                    if future is not None and not future.done():
+                        future.set_result(message)
+                elif "method" in message:
+                    self._dispatch_event(message["method"], message.get("params") or {},
+                                         message.get("sessionId"))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("CDP websocket closed"))
+            self._pending.clear()
+            for session in self._sessions.values():
+                session.attached = False
+            self._sessions.clear()
+            if self._ws is ws:
+                self._ws = None
+
+    def _dispatch_event(self, method, params, session_id=None):
+        tap = getattr(self.tab, "cdp_event_hook", None)
+        if tap is not None:
+            tap(method, params, session_id)
+        for callback in list(self._subscribers.get((session_id, method), [])):
+            try:
+                result = callback(params)
+                if asyncio.iscoroutine(result):
+                    asyncio.ensure_future(result)
+            except Exception as e:
+                print(f"⚠️ CDP 事件回调出错 ({method}): {e}")
+
+    def subscribe(self, method, callback, session_id=None):
+        callbacks = self._subscribers.setdefault((session_id, method), [])
+        callbacks.append(callback)
+
+        def unsubscribe():
+            if callback in callbacks:
+                callbacks.remove(callback)
+        return unsubscribe
+
+    async def _ws_send(self, method, params, session_id, timeout):
+        ws = await self._ensure_connected()
+        message_id = next(self._ids)
+        message = {"id": message_id, "method": method}
+        if params:
+            message["params"] = params
+        if session_id:
+            message["sessionId"] = str(session_id)
+        future = asyncio.get_event_loop().create_future()
+        self._pending[message_id] = future
+        try:
+            async with self._send_lock:
+                await ws.send(json.dumps(message))
+            response = await asyncio.wait_for(future, timeout=timeout)
+        finally:
+            self._pending.pop(message_id, None)
+        if "error" in response:
+            raise CDPError(method, response["error"])
+        return response.get("result", {})
+
+    async def send(self, method, params=None, session_id=None, timeout=None):
+        """发送命令并等待结果；可同时有多个命令在途。出错抛 CDPError，超时抛 asyncio.TimeoutError"""
+        timeout = self.default_timeout if timeout is None else timeout
+
+        async def raw_send(tab, sid, m, p):
+            return await self._ws_send(m, p, sid, timeout)
+
+        hook = getattr(self.tab, "cdp_session_hook", None)
+        if hook is not None:
+            return await hook(raw_send, self.tab, session_id, method, params)
+        return await raw_send(self.tab, session_id, method, params)
+
+    async def attach(self, target_id, enable=("Page", "Runtime"), timeout=None):
+        """attach 到子 target（已 attach 的直接复用），并启用需要接收事件的域。
+        同一 target 的并发 attach 共用一次进行中的 attach，不会产生多余的子会话"""
+        session = self._sessions.get(target_id)
+        if session is not None and session.attached:
+            return session
+        pending = self._attaching.get(target_id)
+        if pending is None:
+            pending = asyncio.ensure_future(self._attach(target_id, enable, timeout))
+            self._attaching[target_id] = pending
+
+            def done(future):
+                if self._attaching.get(target_id) is future:
+                    del self._attaching[target_id]
+            pending.add_done_callback(done)
+        # 某个调用方被取消时不影响其他等待同一 attach 的调用方
+        return await asyncio.shield(pending)
+
+    async def _attach(self, target_id, enable, timeout):
+        result = await self.send("Target.attachToTarget", {"targetId": target_id, "flatten": True},
+                                 timeout=timeout)
+        session = ChildSession(self, target_id, result["sessionId"])
+        self._sessions[target_id] = session
+        try:
+            await asyncio.gather(*(session.send(f"{domain}.enable", timeout=timeout) for domain in enable))
+        except BaseException:
+            # 初始化失败的会话不缓存，detach 后让下次 attach 重新建立
+            await session.detach(timeout=timeout)
+            raise
+        return session
+
+    def _forget(self, session):
+        if self._sessions.get(session.target_id) is session:
+            del self._sessions[session.target_id]
+        for key in [k for k in self._subscribers if k[0] == session.session_id]:
+            del self._subscribers[key]
+
+    def _on_detached(self, params):
+        for session in list(self._sessions.values()):
+            if session.session_id == params.get("sessionId"):
+                session.attached = False
+                self._forget(session)
+
+    async def close(self):
+        """detach 所有子会话并关闭 websocket"""
+        # 先等进行中的 attach 结束，否则它们建立的会话不会被 detach
+        await asyncio.gather(*self._attaching.values(), return_exceptions=True)
+        await asyncio.gather(*(s.detach(timeout=5) for s in list(self._sessions.values())),
+                             return_exceptions=True)
+        if self._ws is not None:
+            await self._ws.close()
+        if self._reader is not None:
+            await asyncio.gather(self._reader, return_exceptions=True)
+        self._ws = None
+        self._reader = None
+
+
+async def find_iframe_target(tab, url_part):
+    """返回属于该 tab、URL 含 url_part 的最后一个（按文档顺序）iframe target id，没有时返回 None。
+    Target.getTargets 列出的是整个浏览器的 target，多个 tab 共用一个浏览器时必须按 tab 的 frame tree 过滤"""
+    tree = await tab.send(cdp_page.get_frame_tree())
+    frame_order = []
+
+    def walk(node):
+        frame_order.append(str(node.frame.id_))
+        for child in node.child_frames or []:
+            walk(child)
+    walk(tree)
+    frame_ids = set(frame_order)
+    own_target = getattr(getattr(tab, "target", None), "target_id", None)
+
+    candidates = []
+    for t in await tab.send(cdp_target.get_targets()):
+        if t.type_ != 'iframe' or url_part not in (t.url or ''):
+            continue
+        tid = str(t.target_id)
+        # 进程外 iframe 的 target id 与它在父页面 frame tree 中的 frame id 相同
+        if tid in frame_ids:
+            candidates.append((frame_order.index(tid), tid))
+        elif (t.parent_frame_id and str(t.parent_frame_id) in frame_ids) or \
+                (own_target is not None and t.parent_id and str(t.parent_id) == str(own_target)):
+            candidates.append((len(frame_order), tid))
+    return max(candidates)[1] if candidates else None
+
+
+def get_session_client(tab):
+    """每个 tab 复用同一个客户端（也供录制/回放把子会话事件送回订阅者）"""
+    client = getattr(tab, "cdp_session_client", None)
+    if client is None:
+        client = CDPSessionClient(tab)
+        tab.cdp_session_client = client
+    return client
+
+
+async def close_session_client(tab):
+    client = getattr(tab, "cdp_session_client", None)
+    if client is not None:
+        tab.cdp_session_client = None
+        await client.close()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""引用提取：解析 output.md 中的内联链接，生成每个报告的 citations.json 和跨报告的来源索引 sources.json"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+CITATIONS_FILE = "citations.json"
+SOURCES_FILE = "sources.json"
+
+# [anchor](url) —— url 中允许出现一层成对括号（如维基百科链接），不匹配图片 ![alt](url)
+LINK_RE = re.compile(r'(?<!!)\[([^\[\]]*)\]\((https?://(?:[^\s()]|\([^\s()]*\))+)\)')
+AUTOLINK_RE = re.compile(r'<(https?://[^\s<>]+)>')
+HEADING_RE = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+# 报告中常见的 "1. **小节标题**" 形式的顶层列表项，也视为一级小节
+LIST_SECTION_RE = re.compile(r'^\d+\.\s+\*\*(.+?)\*\*')
+
+# 去重时丢弃的跟踪参数
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "ref_src", "igshid", "spm"}
+
+
+def normalize_url(url):
+    """规范化 URL 用于去重：小写 scheme/host，去掉 www.、默认端口、fragment（含 #:~:text=）、跟踪参数和末尾斜杠"""
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url.strip()
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    try:
+        port = parts.port if parts.port not in (None, 80, 443) else None
+    except ValueError:
+        # 非数字或越界的端口（如 http://127.0.0.1:PORT/）原样保留
+        port = parts.netloc.rpartition(":")[2] if ":" in parts.netloc.rpartition("@")[2] else None
+    netloc = f"{host}:{port}" if port else host
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS]
+    query.sort()
+    return urlunsplit((scheme, netloc, path, urlencode(query), ""))
+
+
+def iter_citations(lines):
+    """逐行流式解析 Markdown，产出 (url, anchor, section, line_no)；跳过代码块，section 为标题路径"""
+    headings = []
+    in_fence = False
+    for line_no, line in enumerate(lines, 1):
+        stripped = line.strip()
+        if stripped.startswith("```") or stripped.startswith("~~~"):
+            in_fence = not in_fence
+            continue
+        if in_fence:
+            continue
+        m = HEADING_RE.match(stripped)
+        if m:
+            level = len(m.group(1))
+            headings = [h for h in headings if h[0] < level] + [(level, m.group(2))]
+            continue
+        m = LIST_SECTION_RE.match(line)
+        if m:
+            headings = [h for h in headings if h[0] <= 6] + [(7, m.group(1).strip())]
+        if "http" not in line:
+            continue
+        section = " > ".join(h[1] for h in headings)
+        for m in LINK_RE.finditer(line):
+            yield m.group(2), m.group(1).strip(), section, line_no
+        for m in AUTOLINK_RE.finditer(line):
+            yield m.group(1), "", section, line_no
+
+
+def extract_citations(md_path):
+    """解析单个报告，返回按规范化 URL 去重后的引用列表"""
+    by_url = {}
+    with open(md_path, "r", encoding="utf-8", errors="replace") as f:
+        for url, anchor, section, line_no in iter_citations(f):
+            key = normalize_url(url)
+            entry = by_url.get(key)
+            if entry is None:
+                entry = by_url[key] = {
+                    "url": key,
+                    "domain": urlsplit(key).hostname or "",
+                    "anchor": anchor,
+                    "sections": [],
+                    "lines": [],
+                    "count": 0,
+                }
+            if not entry["anchor"] and anchor:
+                entry["anchor"] = anchor
+            if section not in entry["sections"]:
+                entry["sections"].append(section)
+            entry["lines"].append(line_no)
+            entry["count"] += 1
+    return list(by_url.values())
+
+
+def save_citations(md_path, out_path=None):
+    """提取引用并写入报告目录下的 citations.json，返回引用数；失败不影响主流程"""
+    try:
+        md_path = Path(md_path)
+        out_path = Path(out_path) if out_path else md_path.parent / CITATIONS_FILE
+        citations = extract_citations(md_path)
+        with out_path.open("w", encoding="utf-8") as f:
+            json.dump(citations, f, ensure_ascii=False, indent=1)
+        print(f"🔗 已提取 {len(citations)} 个引用来源: {out_path}")
+        return len(citations)
+    except Exception as e:
+        print(f"⚠️ 引用提取失败: {e}")
+        return 0
+
+
+def _process_report(md_path, force=False):
+    """进程池工作函数：citations.json 比 output.md 新时直接复用，否则重新解析；
+    单个报告解析失败时返回 None 作为引用列表，不中断整个索引"""
+    md_path = Path(md_path)
+    out_path = md_path.parent / CITATIONS_FILE
+    try:
+        if not force and out_path.stat().st_mtime_ns >= md_path.stat().st_mtime_ns:
+            with out_path.open("r", encoding="utf-8") as f:
+                return str(md_path.parent), json.load(f), False
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    try:
+        citations = extract_citations(md_path)
+        with out_path.open("w", encoding="utf-8") as f:
+            json.dump(citations, f, ensure_ascii=False, indent=1)
+    except Exception as e:
+        print(f"⚠️ 引用提取失败，已跳过: {md_path}: {e!r}")
+        return str(md_path.parent), None, False
+    return str(md_path.parent), citations, True
+
+
+def build_source_index(response_dir, workers=None, force=False, out_path=None):
+    """批量解析 response/ 下所有报告（进程池并行），生成 来源 → 报告 → 章节 的跨报告索引"""
+    response_dir = Path(response_dir).resolve()
+    md_files = sorted(response_dir.rglob("output.md"))
+    sources = {}
+    parsed = 0
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(md_files) // (workers * 4))
+        results = executor.map(_process_report, md_files, [force] * len(md_files), chunksize=chunksize)
+        for report_dir, citations, reparsed in results:
+            if citations is None:
+                continue
+            parsed += reparsed
+            rel_dir = Path(report_dir).relative_to(response_dir).as_posix()
+            for c in citations:
+                source = sources.setdefault(c["url"], {"domain": c["domain"], "anchor": c["anchor"], "reports": {}})
+                source["reports"][rel_dir] = c["sections"]
+    index = {
+        "generated_at": time.time(),
+        "report_count": len(md_files),
+        "source_count": len(sources),
+        # 被引用报告数多的来源排在前面
+        "sources": dict(sorted(sources.items(), key=lambda kv: (-len(kv[1]["reports"]), kv[0]))),
+    }
+    out_path = Path(out_path) if out_path else response_dir / SOURCES_FILE
+    with out_path.open("w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+    return index, parsed
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='从 Deep Research 报告中提取引用并生成跨报告来源索引')
+    parser.add_argument('--response_dir', type=str, default='response',
+                        help='结果根目录 (默认: response)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='来源索引输出路径 (默认: <response_dir>/sources.json)')
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help='并行解析的进程数 (默认: CPU 核数)')
+    parser.add_argument('--force', action='store_true',
+                        help='忽略已有的 citations.json，全部重新解析')
+    parser.add_argument('--top', type=int, default=10,
+                        help='打印被引用最多的前 N 个来源 (默认: 10)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    response_dir = Path(args.response_dir)
+    if not response_dir.is_dir():
+        print(f"⚠️ 结果目录 '{response_dir}' 不存在")
+        sys.exit(1)
+    start = time.perf_counter()
+    index, parsed = build_source_index(response_dir, workers=args.max_workers,
+                                       force=args.force, out_path=args.output)
+    print(f"🔗 {index['report_count']} 个报告 (重新解析 {parsed} 个), "
+          f"{index['source_count']} 个来源 ({time.perf_counter() - start:.2f}s)")
+    for url, source in list(index['sources'].items())[:args.top]:
+        print(f"  {len(source['reports']):>3}  {url}")
+
+
+if __name__ == "__main__":
+    main()
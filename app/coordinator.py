@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""分布式模式的协调器：持有任务队列，向各主机上的 worker 租出任务（带 TTL），回收结果到本地输出目录"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import yaml
+
+from report_index import update_index
+from run_DeepResearch import SUCCESS_STATUSES, sanitize_path
+
+# 可以重新排队的状态。前三个说明任务没有真正提交到 ChatGPT；worker_error / lease_expired 时任务可能已经提交，
+# 如果 worker 已通过心跳或结果报告了会话 URL，重新租出时带上 resume_url，只继续等待并取回报告而不再次提交
+RETRYABLE_STATUSES = {
+    "deep_research_button_missing",
+    "input_missing",
+    "send_button_missing",
+    "worker_error",
+    "lease_expired",
+}
+# worker 上传的结果文件白名单
+RESULT_FILES = ("output.md", "output.html", "url.txt", "meta.json", "citations.json", "progress.jsonl")
+
+
+def is_conversation_url(url):
+    """是否为已创建会话的 URL（提交前的首页 URL 不能用于继续等待）"""
+    return bool(url) and "/c/" in url
+
+
+class JobQueue:
+    """线程安全的内存任务队列，租约过期的任务自动重新排队"""
+
+    def __init__(self, output_base_dir, lease_ttl=120, max_attempts=3, config=None):
+        self.output_base_dir = Path(output_base_dir)
+        self.lease_ttl = lease_ttl
+        self.max_attempts = max_attempts
+        self.config = config
+        self.jobs = {}
+        self.order = []
+        self.lock = threading.Lock()
+
+    def submit(self, name, prompt, batch="", job_id=None):
+        """加入一个任务；输出目录中已有有效结果的任务直接标记为完成（协调器重启后可续跑）。
+        name / batch 用于拼接输出目录，必须是单个安全的路径片段"""
+        job_id = job_id or uuid.uuid4().hex[:12]
+        name = sanitize_path(name)
+        batch = sanitize_path(batch) if batch else ""
+        job = {
+            "id": job_id,
+            "name": name,
+            "batch": batch,
+            "prompt": prompt,
+            "state": "queued",
+            "status": None,
+            "attempts": 0,
+            "worker": None,
+            "lease_id": None,
+            "lease_expires": None,
+            "error": None,
+            "resume_url": None,
+            "submitted_at": time.time(),
+            "finished_at": None,
+        }
+        if (self.output_dir(job) / "output.md").exists():
+            job["state"] = "done"
+            job["status"] = "completed"
+        with self.lock:
+            if job_id in self.jobs:
+                return self.jobs[job_id]
+            self.jobs[job_id] = job
+            self.order.append(job_id)
+        return job
+
+    def output_dir(self, job):
+        return self.output_base_dir / job["batch"] / job["name"]
+
+    def lease(self, worker):
+        """把最早排队的任务租给 worker，返回任务（含 lease_id）或 None"""
+        with self.lock:
+            self._expire_locked()
+            for job_id in self.order:
+                job = self.jobs[job_id]
+                if job["state"] != "queued":
+                    continue
+                job["state"] = "leased"
+                job["worker"] = worker
+                job["lease_id"] = uuid.uuid4().hex
+                job["lease_expires"] = time.time() + self.lease_ttl
+                job["attempts"] += 1
+                return dict(job)
+        return None
+
+    def _check_lease_locked(self, job_id, lease_id):
+        job = self.jobs.get(job_id)
+        if job is None or job["state"] != "leased" or job["lease_id"] != lease_id:
+            return None
+        return job
+
+    def heartbeat(self, job_id, lease_id, url=None):
+        """续租，url 为 worker 已保存的会话 URL；租约已失效（过期后被重新租出或已结束）时返回 False，worker 应放弃该任务"""
+        with self.lock:
+            job = self._check_lease_locked(job_id, lease_id)
+            if job is None:
+                return False
+            job["lease_expires"] = time.time() + self.lease_ttl
+            if is_conversation_url(url):
+                job["resume_url"] = url
+            return True
+
+    def complete(self, job_id, lease_id, status, files, error=None):
+        """接收 worker 上传的结果：写入输出目录；可重试的失败重新排队，其余标记为 done/failed"""
+        with self.lock:
+            job = self._check_lease_locked(job_id, lease_id)
+            if job is None:
+                return None
+            job["lease_id"] = None
+            job["lease_expires"] = None
+            job["status"] = status
+            job["error"] = error
+            if is_conversation_url((files or {}).get("url.txt")):
+                job["resume_url"] = files["url.txt"].strip()
+            if status in RETRYABLE_STATUSES and job["attempts"] < self.max_attempts:
+                job["state"] = "queued"
+                return dict(job)
+            job["state"] = "done" if status in SUCCESS_STATUSES else "failed"
+            job["finished_at"] = time.time()
+            snapshot = dict(job)
+        if files:
+            out_dir = self.output_dir(snapshot)
+            out_dir.mkdir(parents=True, exist_ok=True)
+            for filename, content in files.items():
+                if filename in RESULT_FILES and content is not None:
+                    (out_dir / filename).write_text(content, encoding="utf-8")
+            if self.config:
+                update_index(self.config, out_dir, response_dir=self.output_base_dir)
+        return snapshot
+
+    def _expire_locked(self):
+        now = time.time()
+        for job in self.jobs.values():
+            if job["state"] == "leased" and job["lease_expires"] < now:
+                print(f"⏰ 租约过期，重新排队: {job['batch']}/{job['name']} (worker={job['worker']})")
+                job["lease_id"] = None
+                job["lease_expires"] = None
+                job["status"] = "lease_expired"
+                if job["attempts"] < self.max_attempts:
+                    job["state"] = "queued"
+                else:
+                    job["state"] = "failed"
+                    job["finished_at"] = now
+
+    def expire(self):
+        with self.lock:
+            self._expire_locked()
+
+    def summary(self):
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job["state"]] = counts.get(job["state"], 0) + 1
+            jobs = [{k: v for k, v in self.jobs[j].items() if k not in ("prompt", "lease_id")}
+                    for j in self.order]
+        drained = not counts.get("queued") and not counts.get("leased")
+        return {"counts": counts, "drained": drained, "jobs": jobs}
+
+
+def load_prompt_dir(queue, prompt_dir, encoding="utf-8"):
+    """把目录下所有 .txt 提示文件加入队列，批次名为目录名（与 batch_process_prompts 的输出布局一致）"""
+    prompt_dir = Path(prompt_dir)
+    count = 0
+    for prompt_file in sorted(prompt_dir.glob('*.txt')):
+        prompt = prompt_file.read_text(encoding=encoding)
+        queue.submit(prompt_file.stem, prompt, batch=prompt_dir.name,
+                     job_id=f"{prompt_dir.name}/{prompt_file.stem}")
+        count += 1
+    return count
+
+
+def make_handler(queue):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if not length:
+                return {}
+            return json.loads(self.rfile.read(length).decode("utf-8"))
+
+        def do_GET(self):
+            if self.path == "/status":
+                self._reply(200, queue.summary())
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            try:
+                data = self._read_json()
+            except (ValueError, UnicodeDecodeError) as e:
+                self._reply(400, {"error": f"invalid json: {e}"})
+                return
+            if self.path == "/lease":
+                job = queue.lease(data.get("worker", self.client_address[0]))
+                if job:
+                    resume = " (继续已提交的会话)" if job["resume_url"] else ""
+                    print(f"📤 租出任务: {job['batch']}/{job['name']} -> {job['worker']} (第 {job['attempts']} 次){resume}")
+                self._reply(200, {"job": job, "lease_ttl": queue.lease_ttl,
+                                  "drained": job is None and queue.summary()["drained"]})
+            elif self.path == "/heartbeat":
+                ok = queue.heartbeat(data.get("job_id"), data.get("lease_id"), data.get("url"))
+                self._reply(200 if ok else 409, {"ok": ok})
+            elif self.path == "/complete":
+                job = queue.complete(data.get("job_id"), data.get("lease_id"),
+                                     data.get("status", "worker_error"), data.get("files") or {},
+                                     data.get("error"))
+                if job is None:
+                    self._reply(409, {"ok": False, "error": "lease lost"})
+                    return
+                mark = "✅" if job["state"] == "done" else ("🔁" if job["state"] == "queued" else "❌")
+                print(f"{mark} {job['batch']}/{job['name']}: {job['status']} ({job['state']})")
+                self._reply(200, {"ok": True, "state": job["state"]})
+            elif self.path == "/submit":
+                if not data.get("name") or data.get("prompt") is None:
+                    self._reply(400, {"error": "name and prompt are required"})
+                    return
+                job = queue.submit(data["name"], data["prompt"], batch=data.get("batch", ""),
+                                   job_id=data.get("id"))
+                self._reply(200, {"id": job["id"], "state": job["state"]})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def _reaper(queue, stop, interval=1.0):
+    while not stop.wait(interval):
+        queue.expire()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='分布式 Deep Research 协调器')
+    parser.add_argument('--prompt_dir', action='append', default=[],
+                        help='提示文件目录（可多次指定）')
+    parser.add_argument('--output_base_dir', default='/app/response',
+                        help='结果输出根目录 (默认: /app/response)')
+    parser.add_argument('--config', type=str, default='config.yaml',
+                        help='配置文件路径，用于更新报告索引 (默认: config.yaml)')
+    parser.add_argument('--host', default='0.0.0.0', help='监听地址 (默认: 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口 (默认: 8765)')
+    parser.add_argument('--lease-ttl', type=int, default=120,
+                        help='租约有效期（秒），worker 需在此时间内心跳 (默认: 120)')
+    parser.add_argument('--max-attempts', type=int, default=3,
+                        help='每个任务最多租出次数 (默认: 3)')
+    parser.add_argument('--exit-when-drained', action='store_true',
+                        help='所有任务结束后自动退出')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    config = None
+    if Path(args.config).exists():
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f)
+    queue = JobQueue(args.output_base_dir, lease_ttl=args.lease_ttl,
+                     max_attempts=args.max_attempts, config=config)
+    for prompt_dir in args.prompt_dir:
+        if not Path(prompt_dir).is_dir():
+            print(f"⚠️ 目录 '{prompt_dir}' 不存在")
+            sys.exit(1)
+        count = load_prompt_dir(queue, prompt_dir)
+        print(f"📂 已加入 {count} 个任务: {prompt_dir}")
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(queue))
+    stop = threading.Event()
+    threading.Thread(target=_reaper, args=(queue, stop), daemon=True).start()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"🛰️ 协调器已启动: http://{args.host}:{args.port} (lease TTL {args.lease_ttl}s)")
+
+    try:
+        while True:
+            time.sleep(5)
+            summary = queue.summary()
+            if args.exit_when_drained and summary["drained"] and summary["jobs"]:
+                break
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    server.shutdown()
+    counts = queue.summary()["counts"]
+    print(f"🏁 协调器退出: 完成 {counts.get('done', 0)} 个, 失败 {counts.get('failed', 0)} 个")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""可导入的异步客户端：在进程内复用一个浏览器运行多个 Deep Research 任务，返回结构化结果并以异步迭代器推送进度事件
+
+    async with DeepResearchClient("config.yaml") as client:
+        result = await client.research("……", timeout=1800)
+        results = await client.research_many(prompts, concurrency=3)
+"""
+
+import asyncio
+import copy
+import shutil
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+
+import nodriver as uc
+import yaml
+
+import run_DeepResearch as dr
+from browser_watchdog import browser_alive
+from cdp_session import close_session_client
+from progress import ProgressCapture
+from report_index import update_index
+
+
+class ResearchStatus(str, Enum):
+    """与 meta.json 中的 status 字段取值一致"""
+    COMPLETED = "completed"
+    COMPLETED_AFTER_TIMEOUT = "completed_after_timeout"
+    TIMEOUT = "timeout"
+    DOWNLOAD_FAILED = "download_failed"
+    BROWSER_FAILED = "browser_failed"
+    DEEP_RESEARCH_BUTTON_MISSING = "deep_research_button_missing"
+    INPUT_MISSING = "input_missing"
+    SEND_BUTTON_MISSING = "send_button_missing"
+    ERROR = "error"
+
+
+@dataclass
+class ProgressEvent:
+    job_id: str
+    phase: str
+    message: str = ""
+    time: float = field(default_factory=time.time)
+
+
+@dataclass
+class Result:
+    job_id: str
+    prompt: str
+    status: ResearchStatus
+    markdown: str = None
+    html: str = None
+    url: str = None
+    timings: dict = field(default_factory=dict)
+    output_dir: Path = None
+    error: str = None
+
+    @property
+    def ok(self):
+        return self.status in (ResearchStatus.COMPLETED, ResearchStatus.COMPLETED_AFTER_TIMEOUT)
+
+    @property
+    def durations(self):
+        """各阶段耗时（秒）：submit / wait / harvest / total"""
+        t = self.timings
+        spans = {"submit": ("started_at", "sent_at"), "wait": ("sent_at", "research_done_at"),
+                 "harvest": ("research_done_at", "downloaded_at"), "total": ("started_at", "finished_at")}
+        return {name: t[b] - t[a] for name, (a, b) in spans.items() if a in t and b in t}
+
+
+class DeepResearchClient:
+    """所有任务共享一个浏览器，每个任务一个 tab。输入/下载等需要前台交互的阶段串行执行，长时间等待阶段并发"""
+
+    def __init__(self, config_path="config.yaml", output_dir=None, headless=None):
+        with Path(config_path).open("r", encoding="utf-8") as f:
+            self.config = yaml.safe_load(f)
+        if headless is not None:
+            self.config['browser']['headless'] = headless
+        # 指定 output_dir 时结果按 run_DeepResearch 的目录结构保存并写入报告索引，否则只在内存中返回
+        self.output_dir = Path(output_dir) if output_dir else None
+        self.browser = None
+        self._start_lock = asyncio.Lock()
+        self._ui_lock = asyncio.Lock()
+        self._listeners = []
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def start(self):
+        async with self._start_lock:
+            if self.browser is None:
+                self.browser = await uc.start(headless=self.config['browser']['headless'])
+                await self.browser.cookies.load()
+        return self.browser
+
+    async def close(self):
+        if self.browser is not None:
+            try:
+                await self.browser.cookies.save()
+            finally:
+                self.browser.stop()
+                self.browser = None
+        for queue in self._listeners:
+            queue.put_nowait(None)
+
+    async def events(self):
+        """异步迭代所有任务的进度事件，客户端关闭时结束"""
+        queue = asyncio.Queue()
+        self._listeners.append(queue)
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            self._listeners.remove(queue)
+
+    def _emit(self, job_id, phase, message=""):
+        event = ProgressEvent(job_id, phase, message)
+        for queue in self._listeners:
+            queue.put_nowait(event)
+
+    async def _reopen(self, failed_browser, tab, job_id, url):
+        """浏览器故障后重新打开本任务的会话。浏览器进程和浏览器级连接仍正常时（单个 tab 的 renderer 崩溃/卡死）
+        只关闭并重开本任务的 tab，不影响其他任务；否则共享浏览器只由第一个发现故障的任务重启"""
+        self._emit(job_id, "browser_restart", url)
+        try:
+            await close_session_client(tab)
+        except Exception:
+            pass
+        timeout = self.config.get('watchdog', {}).get('probe_timeout', 15)
+        async with self._start_lock:
+            if self.browser is failed_browser and await browser_alive(failed_browser, timeout):
+                try:
+                    await asyncio.wait_for(failed_browser.connection.send(
+                        uc.cdp.target.close_target(tab.target.target_id)), timeout=timeout)
+                except Exception:
+                    pass
+            elif self.browser is failed_browser:
+                # 先清空再停止：重启过程被取消（如 research 的 timeout）时，后续任务由 start() 重新启动浏览器，
+                # 而不会继续使用已停止的浏览器
+                self.browser = None
+                try:
+                    failed_browser.stop()
+                except Exception:
+                    pass
+                browser = await uc.start(headless=self.config['browser']['headless'])
+                await browser.cookies.load()
+                self.browser = browser
+        if self.browser is None:
+            await self.start()
+        tab = await self.browser.get(url, new_tab=True)
+        await tab.sleep(self.config['timings']['initial_wait'])
+        return self.browser, tab
+
+    async def research(self, prompt, *, timeout=None, name=None):
+        """运行一个 Deep Research 任务，返回 Result；不抛出任务失败，失败体现在 Result.status / error 中。
+        timeout 为提交后等待研究完成的最长秒数（硬上限，包括刷新重试和浏览器重启），超时后仍尝试取回报告"""
+        await self.start()
+        job_id = dr.sanitize_path(name) if name else uuid.uuid4().hex[:12]
+        config = copy.deepcopy(self.config)
+        if timeout is not None:
+            config['timings']['max_wait_time'] = timeout
+        if self.output_dir is not None:
+            job_dir = self.output_dir / job_id
+            job_dir.mkdir(parents=True, exist_ok=True)
+        else:
+            job_dir = Path(tempfile.mkdtemp(prefix="deep_research_"))
+        download_dir = job_dir / ".downloads"
+        md_path = job_dir / dr.sanitize_path(config['output']['markdown_file'])
+        html_path = job_dir / dr.sanitize_path(config['output']['html_file'])
+        timings = {"started_at": time.time()}
+        result = Result(job_id=job_id, prompt=prompt, status=ResearchStatus.ERROR, timings=timings,
+                        output_dir=job_dir if self.output_dir is not None else None)
+        tab = None
+        try:
+            async with self._ui_lock:
+                self._emit(job_id, "submitting")
+                tab = await self.browser.get(config['urls']['chatgpt'], new_tab=True)
+                await tab.sleep(config['timings']['initial_wait'])
+                container, status = await dr.open_deep_research(tab, config)
+                if container is not None and not await dr.submit_prompt(tab, config, container, prompt):
+                    status = ResearchStatus.SEND_BUTTON_MISSING.value
+                if status:
+                    result.status = ResearchStatus(status)
+                    return result
+                timings["sent_at"] = time.time()
+                await tab.sleep(config['timings']['initial_wait'])
+                result.url = await dr.save_conversation_url(tab, job_dir, wait=30)
+            self._emit(job_id, "waiting", result.url)
+
+            current = {"tab": tab}
+
+            async def reopen(browser, old_tab, reason):
+                browser, current["tab"] = await self._reopen(browser, old_tab, job_id, result.url)
+                return browser, current["tab"]
+
+            # 进度节点同时写入 progress.jsonl 并作为 "activity" 事件推送；
+            # 任务运行在服务进程内，不记录 pid，避免 `progress.py stop` 终止整个服务
+            progress = ProgressCapture.from_config(
+                config, job_dir, on_item=lambda item: self._emit(
+                    job_id, "activity", item.get("url") or item.get("text", "")), record_pid=False)
+            restarts = failure = None
+            try:
+                research_done, _, tab, restarts, failure = await asyncio.wait_for(
+                    dr.wait_with_recovery(self.browser, tab, config, result.url, reopen, progress=progress),
+                    timeout=timeout)
+            except asyncio.TimeoutError:
+                research_done, tab = False, current["tab"]
+                self._emit(job_id, "timeout", f"{timeout}s")
+            timings["research_done_at"] = time.time()
+            if restarts:
+                timings["browser_restarts"] = restarts
+            if failure:
+                timings["browser_failure"] = failure
+                result.status = ResearchStatus.BROWSER_FAILED
+                result.error = failure
+                return result
+
+            async with self._ui_lock:
+                self._emit(job_id, "harvesting")
+                await tab.bring_to_front()
+                result.url = await dr.save_conversation_url(tab, job_dir)
+                # 下载阶段在 _ui_lock 内串行执行，可以安全地把浏览器级下载目录切换到本任务专用目录
+                Path(download_dir).mkdir(parents=True, exist_ok=True)
+                try:
+                    await tab.send(uc.cdp.browser.set_download_behavior(
+                        behavior="allow", download_path=str(download_dir)))
+                except Exception as e:
+                    print(f"⚠️ 设置下载目录失败: {e}")
+                downloaded = await dr.harvest_report(tab, config, md_path, html_path, str(download_dir))
+            timings["downloaded_at"] = time.time()
+            result.status = ResearchStatus(dr.final_status(downloaded, research_done))
+            if md_path.exists():
+                result.markdown = md_path.read_text(encoding="utf-8", errors="replace")
+            if html_path.exists():
+                result.html = html_path.read_text(encoding="utf-8", errors="replace")
+        except Exception as e:
+            result.status = ResearchStatus.ERROR
+            result.error = repr(e)
+        finally:
+            timings["finished_at"] = time.time()
+            if tab is not None:
+                try:
+                    await close_session_client(tab)
+                    await tab.close()
+                except Exception:
+                    pass
+            shutil.rmtree(download_dir, ignore_errors=True)
+            if self.output_dir is not None:
+                dr.save_meta(job_dir, f"<client:{job_id}>", prompt, timings, result.status.value, result.url)
+                update_index(config, job_dir, response_dir=self.output_dir)
+            else:
+                shutil.rmtree(job_dir, ignore_errors=True)
+            self._emit(job_id, "finished", result.status.value)
+        return result
+
+    async def research_many(self, prompts, concurrency=3, *, timeout=None, interval=10):
+        """并发运行多个任务（最多 concurrency 个同时等待），按输入顺序返回结果。
+        prompts 可为字符串列表或 {name: prompt} 字典；interval 为相邻任务的启动间隔（秒）"""
+        items = list(prompts.items()) if isinstance(prompts, dict) else [(None, p) for p in prompts]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(index, name, prompt):
+            await asyncio.sleep(index * interval if index < concurrency else 0)
+            async with semaphore:
+                return await self.research(prompt, timeout=timeout, name=name)
+
+        return await asyncio.gather(*(run(i, name, prompt) for i, (name, prompt) in enumerate(items)))
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""提示模板展开：用一个模板和一张参数表（CSV/TSV/JSONL）批量生成任务，逐行惰性展开并流式交给批处理调度器
+
+模板中用 {{列名}} 引用参数，例如:
+
+    请调研 {{state}} 州的 {{topic}}，列出主要数据来源。
+"""
+
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+
+from batch_process_prompts import process_prompt_text, run_streaming
+from citations import build_source_index
+from run_DeepResearch import SUCCESS_STATUSES, sanitize_path
+
+PLACEHOLDER_RE = re.compile(r"\{\{\s*([^{}]+?)\s*\}\}")
+# 结果表中由本工具填写的列，放在参数列之后
+RESULT_COLUMNS = ("job_id", "status", "report", "url", "output_dir", "elapsed")
+
+
+class TemplateError(Exception):
+    """模板引用了参数表中不存在的列"""
+
+
+class BadRow:
+    """iter_rows 对无法解析的行产出的标记，由 iter_jobs 记为 template_error，不中断整个展开"""
+
+    def __init__(self, line_no, error):
+        self.line_no = line_no
+        self.error = error
+
+
+def iter_rows(params_path, encoding="utf-8"):
+    """逐行读取参数表，按扩展名识别格式；不把整张表读入内存。JSONL 中无法解析的行产出 BadRow"""
+    params_path = Path(params_path)
+    suffix = params_path.suffix.lower()
+    with params_path.open("r", encoding=encoding, newline="") as f:
+        if suffix in (".jsonl", ".ndjson"):
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield BadRow(line_no, f"不是有效的 JSON (文件第 {line_no} 行): {e}")
+                    continue
+                if not isinstance(row, dict):
+                    yield BadRow(line_no, f"不是 JSON 对象 (文件第 {line_no} 行)")
+                    continue
+                yield row
+        else:
+            delimiter = "\t" if suffix == ".tsv" else ","
+            yield from csv.DictReader(f, delimiter=delimiter)
+
+
+def template_fields(template):
+    return [m.group(1) for m in PLACEHOLDER_RE.finditer(template)]
+
+
+def render(template, row):
+    def replace(match):
+        key = match.group(1)
+        if key not in row or row[key] is None:
+            raise TemplateError(key)
+        value = row[key]
+        return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+    return PLACEHOLDER_RE.sub(replace, template)
+
+
+def job_id_for(row, id_column=None):
+    """稳定的任务 ID：指定 id_column 时取该列的值，否则取参数内容的哈希（与行顺序无关，重跑时不变）"""
+    if id_column:
+        return sanitize_path(str(row[id_column]))
+    digest = hashlib.sha1(json.dumps(row, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    return "row-" + digest.hexdigest()[:12]
+
+
+def iter_jobs(template, rows, sweep_dir, id_column=None):
+    """把参数行惰性展开为任务；无法运行的行也会产出（带 error 和 skip_status），以便写入结果表。
+    为避免两个任务写同一个输出目录，重复的任务 ID 只运行第一次出现的行（只保存 ID 集合，不保存行内容）"""
+    seen_ids = set()
+    for index, row in enumerate(rows):
+        if isinstance(row, BadRow):
+            yield {"index": index, "row": {}, "id": f"line-{row.line_no}", "prompt": None, "error": row.error,
+                   "skip_status": "template_error", "output_dir": Path(sweep_dir) / f"line-{row.line_no}"}
+            continue
+        # csv.DictReader 把多出表头的字段放在键 None 下
+        extra = row.pop(None, None)
+        job = {"index": index, "row": row, "id": f"row-{index}", "prompt": None, "error": None,
+               "skip_status": "template_error"}
+        try:
+            job["id"] = job_id_for(row, id_column)
+            if extra is not None:
+                job["error"] = f"字段数多于表头，多出: {extra}"
+            else:
+                job["prompt"] = render(template, row)
+        except TemplateError as e:
+            job["error"] = f"参数表缺少列: {e}"
+        except (KeyError, TypeError, ValueError) as e:
+            job["error"] = f"无效的参数行: {e!r}"
+        if not job["error"]:
+            if job["id"] in seen_ids:
+                job["error"] = f"任务 ID 重复: {job['id']}"
+                job["skip_status"] = "duplicate"
+            seen_ids.add(job["id"])
+        job["output_dir"] = Path(sweep_dir) / job["id"]
+        yield job
+
+
+def read_meta(output_dir):
+    try:
+        with (Path(output_dir) / "meta.json").open("r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def is_completed(output_dir, statuses=SUCCESS_STATUSES):
+    meta = read_meta(output_dir)
+    return bool(meta) and meta.get("status") in statuses and (Path(output_dir) / "output.md").exists()
+
+
+class ResultsWriter:
+    """边完成边追加的结果表（参数列 + 任务列），每行写完立即 flush，支持 CSV/TSV/JSONL"""
+
+    def __init__(self, path, param_columns):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self._file = self.path.open("w", encoding="utf-8", newline="")
+        self._csv = None
+        if self.path.suffix.lower() not in (".jsonl", ".ndjson"):
+            columns = [c for c in param_columns if c not in RESULT_COLUMNS] + list(RESULT_COLUMNS)
+            delimiter = "\t" if self.path.suffix.lower() == ".tsv" else ","
+            self._csv = csv.DictWriter(self._file, fieldnames=columns, delimiter=delimiter,
+                                       extrasaction="ignore")
+            self._csv.writeheader()
+
+    def write(self, job, status, elapsed=None):
+        meta = read_meta(job["output_dir"]) or {}
+        report = Path(job["output_dir"]) / "output.md"
+        record = dict(job["row"])
+        record.update({
+            "job_id": job["id"],
+            "status": status,
+            "report": str(report) if report.exists() else "",
+            "url": meta.get("url") or "",
+            "output_dir": str(job["output_dir"]),
+            "elapsed": round(elapsed, 1) if elapsed is not None else "",
+        })
+        with self.lock:
+            if self._csv is not None:
+                self._csv.writerow(record)
+            else:
+                self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def run_fanout(template, params_path, output_base_dir, sweep_name=None, results_path=None,
+               id_column=None, max_workers=5, interval=10, limit=None, rerun=False, encoding="utf-8"):
+    """展开模板并运行所有任务，返回各状态的计数"""
+    sweep_name = sanitize_path(sweep_name or Path(params_path).stem)
+    sweep_dir = Path(output_base_dir) / sweep_name
+    sweep_dir.mkdir(parents=True, exist_ok=True)
+    results_path = Path(results_path) if results_path else sweep_dir / "results.csv"
+
+    rows = iter_rows(params_path, encoding)
+    # 表头只需要第一个可解析的行；其余行仍然逐行读取
+    head = []
+    for row in rows:
+        head.append(row)
+        if not isinstance(row, BadRow):
+            break
+    if not head:
+        print("⚠️ 参数表为空")
+        return {}
+    first = head[-1] if not isinstance(head[-1], BadRow) else {}
+    rows = itertools.chain(head, rows)
+    if limit is not None:
+        rows = itertools.islice(rows, limit)
+    missing = [f for f in template_fields(template) if f not in first]
+    if first and missing:
+        print(f"⚠️ 参数表第一行缺少模板引用的列: {', '.join(missing)}")
+
+    writer = ResultsWriter(results_path, list(first.keys()))
+    counts = {}
+    started = {}
+
+    def record(job, status):
+        counts[status] = counts.get(status, 0) + 1
+        # 被跳过的重复行与正在运行的任务同 ID，不计耗时
+        elapsed = time.time() - started[job["id"]] if job["id"] in started and not job["error"] else None
+        writer.write(job, status, elapsed)
+
+    def runnable():
+        """过滤掉无需运行的任务（渲染失败 / 已完成），直接写入结果表"""
+        for job in iter_jobs(template, rows, sweep_dir, id_column):
+            if job["error"]:
+                print(f"⚠️ 第 {job['index'] + 1} 行 ({job['id']}): {job['error']}")
+                record(job, job["skip_status"])
+            elif not rerun and is_completed(job["output_dir"]):
+                record(job, read_meta(job["output_dir"])["status"])
+            else:
+                yield job
+
+    def worker(job):
+        started[job["id"]] = time.time()
+        return process_prompt_text(job["id"], job["prompt"], sweep_dir)
+
+    def on_done(job, ok):
+        meta = read_meta(job["output_dir"])
+        status = meta.get("status") if meta else None
+        record(job, status or ("error" if not ok else "unknown"))
+        started.pop(job["id"], None)
+
+    print(f"🧩 模板展开: {params_path} -> {sweep_dir}")
+    print(f"📄 结果表: {results_path}")
+    try:
+        run_streaming(runnable(), worker, max_workers, interval, on_done)
+    finally:
+        writer.close()
+    return counts
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='用提示模板和参数表批量运行 Deep Research')
+    parser.add_argument('--template', required=True,
+                        help='提示模板文件，用 {{列名}} 引用参数')
+    parser.add_argument('--params', required=True,
+                        help='参数表 (.csv / .tsv / .jsonl)')
+    parser.add_argument('--output_base_dir', default='/app/response',
+                        help='输出目录的根路径 (默认: /app/response)')
+    parser.add_argument('--name', default=None,
+                        help='本次展开的批次名，即输出子目录名 (默认: 参数表文件名)')
+    parser.add_argument('--results', default=None,
+                        help='结果表路径，.csv/.tsv/.jsonl (默认: <输出目录>/results.csv)')
+    parser.add_argument('--id-column', default=None,
+                        help='作为任务 ID 的列 (默认: 参数内容的哈希)')
+    parser.add_argument('--interval', type=int, default=10,
+                        help='启动新任务的间隔（秒）(默认: 10)')
+    parser.add_argument('--max-workers', type=int, default=5,
+                        help='同时运行的最大进程数 (默认: 5)')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='只处理前 N 行')
+    parser.add_argument('--rerun', action='store_true',
+                        help='重新运行已完成的任务')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='只打印展开后的任务 ID 和提示，不运行')
+    parser.add_argument('--encoding', default='utf-8',
+                        help='模板和参数表的编码 (默认: utf-8)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    template = Path(args.template).read_text(encoding=args.encoding)
+    if not PLACEHOLDER_RE.search(template):
+        print("⚠️ 模板中没有 {{列名}} 占位符，所有任务的提示都相同")
+
+    if not Path(args.params).exists():
+        print(f"⚠️ 参数表 '{args.params}' 不存在")
+        sys.exit(1)
+
+    if args.dry_run:
+        rows = itertools.islice(iter_rows(args.params, args.encoding), args.limit)
+        for job in iter_jobs(template, rows, Path(args.output_base_dir), args.id_column):
+            print(f"# {job['id']}")
+            print(job["error"] or job["prompt"])
+            print("----------------------------------------")
+        return
+
+    counts = run_fanout(template, args.params, args.output_base_dir, sweep_name=args.name,
+                        results_path=args.results, id_column=args.id_column,
+                        max_workers=args.max_workers, interval=args.interval, limit=args.limit,
+                        rerun=args.rerun, encoding=args.encoding)
+    if not counts:
+        return
+    summary = ", ".join(f"{status} {n}" for status, n in sorted(counts.items()))
+    print(f"🏁 全部结束: {summary}")
+    index, _ = build_source_index(args.output_base_dir)
+    print(f"🔗 已更新引用来源索引: {index['source_count']} 个来源")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""多阶段提示链：按依赖关系（DAG）运行一组提示，下游阶段可注入上游报告（全文或摘要）或在上游会话中继续提问。
+互不依赖的分支并发运行，每个阶段在其所有上游完成后立即启动。
+
+流水线定义 (YAML):
+
+    name: ssl_pinning              # 输出子目录名 (默认: 文件名)
+    context_chars: 6000            # 注入上下文的长度上限
+    phases:
+      phase1-2:
+        prompt_file: Phase1-2.txt  # 相对于流水线文件；也可用 prompt: 直接写提示
+      phase3-4:
+        prompt_file: Phase3-4.txt
+        depends_on: [phase1-2]
+        inject: summary            # report / summary / none
+      phase7:
+        prompt_file: Phase7.txt
+        depends_on: [phase3-4]
+        continue_conversation: true  # 在 phase3-4 的会话中继续提问（只能有一个上游）
+
+提示中出现 {{阶段名}} 时注入内容替换该占位符，否则整体放在提示前面。
+"""
+
+import argparse
+import concurrent.futures
+import json
+import re
+import sys
+import time
+from pathlib import Path
+
+import yaml
+
+from batch_process_prompts import process_prompt_text
+from fanout import PLACEHOLDER_RE, is_completed, read_meta
+from run_DeepResearch import SUCCESS_STATUSES, sanitize_path
+
+INJECT_MODES = ("report", "summary", "none")
+DEFAULT_CONTEXT_HEADER = "Results of the earlier research phases (use them as the basis for this phase):"
+
+MD_LINK_RE = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+HEADING_RE = re.compile(r"^#{1,6}\s")
+
+
+class PipelineError(Exception):
+    """流水线定义有误（未知依赖、循环依赖等）"""
+
+
+def load_pipeline(path):
+    """读取并校验流水线定义，返回 dict；各阶段的 prompt 已读入"""
+    path = Path(path)
+    with path.open("r", encoding="utf-8") as f:
+        spec = yaml.safe_load(f) or {}
+    phases = spec.get("phases") or {}
+    if not isinstance(phases, dict) or not phases:
+        raise PipelineError("phases 必须是非空的映射 (阶段名: 定义)")
+    encoding = spec.get("encoding", "utf-8")
+    for phase_id, phase in phases.items():
+        # 阶段名直接用作输出子目录名（run_DeepResearch 会对其 sanitize_path），这里要求二者一致
+        if not isinstance(phase_id, str) or sanitize_path(phase_id) != phase_id:
+            raise PipelineError(f"{phase_id!r}: 阶段名不能为空，不能包含 <>:\"/\\|?* 或首尾的空白和点")
+        if "prompt" not in phase and "prompt_file" not in phase:
+            raise PipelineError(f"{phase_id}: 需要 prompt 或 prompt_file")
+        if "prompt" not in phase:
+            phase["prompt"] = (path.parent / phase["prompt_file"]).read_text(encoding=encoding)
+        deps = phase.get("depends_on") or []
+        phase["depends_on"] = [deps] if isinstance(deps, str) else list(deps)
+        for dep in phase["depends_on"]:
+            if dep not in phases:
+                raise PipelineError(f"{phase_id}: 未知的依赖 {dep}")
+        if phase.get("continue_conversation") and len(phase["depends_on"]) != 1:
+            raise PipelineError(f"{phase_id}: continue_conversation 需要恰好一个依赖")
+        inject = phase.get("inject", "none" if phase.get("continue_conversation") else "summary")
+        if inject not in INJECT_MODES:
+            raise PipelineError(f"{phase_id}: inject 必须是 {' / '.join(INJECT_MODES)}")
+        phase["inject"] = inject
+    topological_order(phases)
+    check_shared_conversations(phases)
+    spec["name"] = sanitize_path(spec.get("name") or path.stem)
+    return spec
+
+
+def topological_order(phases):
+    """返回拓扑序；存在循环依赖时抛出 PipelineError"""
+    order, state = [], {}
+
+    def visit(phase_id, trail):
+        if state.get(phase_id) == "done":
+            return
+        if state.get(phase_id) == "visiting":
+            raise PipelineError("循环依赖: " + " -> ".join(trail + [phase_id]))
+        state[phase_id] = "visiting"
+        for dep in phases[phase_id]["depends_on"]:
+            visit(dep, trail + [phase_id])
+        state[phase_id] = "done"
+        order.append(phase_id)
+
+    for phase_id in phases:
+        visit(phase_id, [])
+    return order
+
+
+def check_shared_conversations(phases):
+    """continue_conversation 的阶段写入其上游所在的会话（沿续接链一直到第一个新建会话的阶段）。
+    同一会话中的阶段必须有先后依赖，否则会并发地向同一个会话发送消息并采集同一个 iframe"""
+    def root(phase_id):
+        while phases[phase_id].get("continue_conversation"):
+            phase_id = phases[phase_id]["depends_on"][0]
+        return phase_id
+
+    ancestors = {}
+    for phase_id in topological_order(phases):
+        ancestors[phase_id] = set()
+        for dep in phases[phase_id]["depends_on"]:
+            ancestors[phase_id] |= ancestors[dep] | {dep}
+
+    by_root = {}
+    for phase_id, phase in phases.items():
+        if phase.get("continue_conversation"):
+            by_root.setdefault(root(phase_id), []).append(phase_id)
+    for conversation, members in by_root.items():
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                if a not in ancestors[b] and b not in ancestors[a]:
+                    raise PipelineError(f"{a}, {b}: 都续接阶段 {conversation} 的会话，但彼此没有依赖关系，"
+                                        f"会并发写入同一个会话；请让其中一个依赖另一个")
+
+
+def critical_path_depth(phases):
+    """每个阶段到终点的最长链长度（阶段数），用于在并发受限时优先启动关键路径上的阶段"""
+    dependents = {p: [] for p in phases}
+    for phase_id, phase in phases.items():
+        for dep in phase["depends_on"]:
+            dependents[dep].append(phase_id)
+    depth = {}
+    for phase_id in reversed(topological_order(phases)):
+        depth[phase_id] = 1 + max((depth[d] for d in dependents[phase_id]), default=0)
+    return depth
+
+
+def summarize_report(markdown, max_chars):
+    """抽取式摘要：保留各级标题和每个标题下的第一段，去掉链接地址"""
+    lines, take_paragraph = [], True
+    for block in re.split(r"\n\s*\n", markdown):
+        block = MD_LINK_RE.sub(r"\1", block.strip())
+        if not block:
+            continue
+        if HEADING_RE.match(block):
+            heading, _, rest = block.partition("\n")
+            lines.append(heading)
+            take_paragraph = True
+            block = rest.strip()
+            if not block:
+                continue
+        if take_paragraph:
+            lines.append(block)
+            take_paragraph = False
+    return truncate("\n\n".join(lines), max_chars)
+
+
+def truncate(text, max_chars):
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + "\n…"
+
+
+def build_prompt(phase, upstream, max_chars, header=DEFAULT_CONTEXT_HEADER):
+    """把上游报告注入提示。upstream 为 {阶段名: Markdown}"""
+    if phase["inject"] == "none" or not upstream:
+        return phase["prompt"]
+    per_phase = max(500, max_chars // len(upstream))
+    contexts = {}
+    for dep, markdown in upstream.items():
+        if phase["inject"] == "summary":
+            contexts[dep] = summarize_report(markdown, per_phase)
+        else:
+            contexts[dep] = truncate(markdown, per_phase)
+
+    prompt = phase["prompt"]
+    if any(m.group(1) in contexts for m in PLACEHOLDER_RE.finditer(prompt)):
+        return PLACEHOLDER_RE.sub(lambda m: contexts.get(m.group(1), m.group(0)), prompt)
+    blocks = "\n\n".join(f"=== {dep} ===\n{text}" for dep, text in contexts.items())
+    return f"{header}\n\n{blocks}\n\n---\n\n{prompt}"
+
+
+def read_report(output_dir):
+    md_path = Path(output_dir) / "output.md"
+    if not md_path.exists():
+        return None
+    return md_path.read_text(encoding="utf-8", errors="replace")
+
+
+def run_pipeline(spec, output_base_dir, max_workers=None, interval=10, rerun=False):
+    """运行流水线，返回 {阶段名: 状态记录}；同时把状态写入 <输出目录>/pipeline.json"""
+    phases = spec["phases"]
+    pipeline_dir = Path(output_base_dir) / spec["name"]
+    pipeline_dir.mkdir(parents=True, exist_ok=True)
+    max_workers = max_workers or spec.get("max_workers", 3)
+    max_chars = spec.get("context_chars", 6000)
+    header = spec.get("context_header", DEFAULT_CONTEXT_HEADER)
+    depth = critical_path_depth(phases)
+
+    records = {p: {"status": "pending", "depends_on": phases[p]["depends_on"]} for p in phases}
+    state_path = pipeline_dir / "pipeline.json"
+
+    def save_state():
+        with state_path.open("w", encoding="utf-8") as f:
+            json.dump({"name": spec["name"], "phases": records}, f, ensure_ascii=False, indent=2)
+
+    def finish(phase_id, status):
+        record = records[phase_id]
+        record["status"] = status
+        record["finished_at"] = time.time()
+        meta = read_meta(pipeline_dir / phase_id) or {}
+        record["url"] = meta.get("url")
+        mark = "✅" if status in SUCCESS_STATUSES else "❌"
+        print(f"{mark} 阶段 {phase_id}: {status}")
+
+    # 已完成的阶段直接复用（重跑时只运行未完成的部分）
+    if not rerun:
+        for phase_id in phases:
+            if is_completed(pipeline_dir / phase_id):
+                finish(phase_id, read_meta(pipeline_dir / phase_id)["status"])
+
+    def ready():
+        waiting = [p for p, r in records.items() if r["status"] == "pending"
+                   and all(records[d]["status"] in SUCCESS_STATUSES for d in phases[p]["depends_on"])]
+        return sorted(waiting, key=lambda p: -depth[p])
+
+    def skip_blocked():
+        changed = True
+        while changed:
+            changed = False
+            for phase_id, record in records.items():
+                if record["status"] != "pending":
+                    continue
+                failed = [d for d in phases[phase_id]["depends_on"]
+                          if records[d]["status"] not in SUCCESS_STATUSES | {"pending", "running"}]
+                if failed:
+                    finish(phase_id, "upstream_failed")
+                    record["error"] = f"上游阶段失败: {', '.join(failed)}"
+                    changed = True
+
+    def run_phase(phase_id):
+        phase = phases[phase_id]
+        upstream = {}
+        for dep in phase["depends_on"]:
+            report = read_report(pipeline_dir / dep)
+            if report:
+                upstream[dep] = report
+        prompt = build_prompt(phase, upstream, max_chars, header)
+        conversation_url = None
+        if phase.get("continue_conversation"):
+            conversation_url = records[phase["depends_on"][0]].get("url")
+            if not conversation_url or "/c/" not in conversation_url:
+                print(f"⚠️ 阶段 {phase_id}: 上游没有可继续的会话 URL，改为新建会话")
+                conversation_url = None
+        return process_prompt_text(phase_id, prompt, pipeline_dir, conversation_url=conversation_url)
+
+    print(f"🧬 流水线 {spec['name']}: {len(phases)} 个阶段, 最多 {max_workers} 个并发 -> {pipeline_dir}")
+    started_at = time.time()
+    last_start = None
+    in_flight = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            skip_blocked()
+            for phase_id in ready()[:max_workers - len(in_flight)]:
+                if last_start is not None:
+                    time.sleep(max(0, last_start + interval - time.time()))
+                last_start = time.time()
+                records[phase_id].update(status="running", started_at=last_start)
+                print(f"▶️ 启动阶段 {phase_id}")
+                in_flight[executor.submit(run_phase, phase_id)] = phase_id
+            save_state()
+            if not in_flight:
+                break
+            done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                phase_id = in_flight.pop(future)
+                try:
+                    ok = future.result()
+                except Exception as e:
+                    print(f"⚠️ 阶段 {phase_id} 出错: {e}")
+                    ok = False
+                meta = read_meta(pipeline_dir / phase_id)
+                finish(phase_id, (meta or {}).get("status") or ("error" if not ok else "unknown"))
+
+    wall = time.time() - started_at
+    busy = sum(r["finished_at"] - r["started_at"] for r in records.values()
+               if "started_at" in r and "finished_at" in r)
+    print(f"🏁 流水线结束: 用时 {wall / 60:.1f} 分钟 (各阶段合计 {busy / 60:.1f} 分钟)")
+    save_state()
+    return records
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='按依赖关系运行多阶段 Deep Research 提示链')
+    parser.add_argument('pipeline', help='流水线定义文件 (YAML)')
+    parser.add_argument('--output_base_dir', default='/app/response',
+                        help='输出目录的根路径 (默认: /app/response)')
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help='同时运行的最大阶段数 (默认: 流水线中的 max_workers，否则 3)')
+    parser.add_argument('--interval', type=int, default=10,
+                        help='启动新阶段的最小间隔（秒）(默认: 10)')
+    parser.add_argument('--rerun', action='store_true',
+                        help='重新运行已完成的阶段')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='只校验定义并打印执行顺序')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    try:
+        spec = load_pipeline(args.pipeline)
+    except (PipelineError, OSError, yaml.YAMLError) as e:
+        print(f"❌ 流水线定义无效: {e}")
+        sys.exit(1)
+    if args.dry_run:
+        depth = critical_path_depth(spec["phases"])
+        for phase_id in topological_order(spec["phases"]):
+            phase = spec["phases"][phase_id]
+            deps = ", ".join(phase["depends_on"]) or "-"
+            mode = "继续会话" if phase.get("continue_conversation") else f"inject={phase['inject']}"
+            print(f"{phase_id}: 依赖 {deps} ({mode}, 关键路径长度 {depth[phase_id]})")
+        print(f"关键路径: {max(depth.values())} 个阶段")
+        return
+    records = run_pipeline(spec, args.output_base_dir, max_workers=args.max_workers,
+                           interval=args.interval, rerun=args.rerun)
+    if any(r["status"] not in SUCCESS_STATUSES for r in records.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Deep Research 运行过程的增量进度捕获：等待期间低频拉取 internal://deep-research iframe 中新增/变化的活动节点
+（访问的来源、推理步骤、已生成的章节），追加到任务目录的 progress.jsonl；并提供跨任务的实时状态视图
+
+    python progress.py status response/<batch> [--watch 10]
+    python progress.py tail response/<batch>/<job>
+    python progress.py stop response/<batch>/<job>
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import time
+from pathlib import Path
+
+from cdp_session import CDPError, find_iframe_target, get_session_client
+
+PROGRESS_FILE = "progress.jsonl"
+DEFAULT_SELECTORS = "h1, h2, h3, h4, p, li, a[href]"
+
+# 在 iframe 的 isolated world 中执行；已返回过的节点记在该 world 的全局状态里，每次只返回新增或文本变化的节点
+COLLECT_JS = '''
+(() => {
+    const selectors = %(selectors)s;
+    const blockSelectors = %(block_selectors)s;
+    const maxItems = %(max_items)d;
+    const state = window.__drProgress || (window.__drProgress = {last: new WeakMap(), urls: new Set()});
+    const out = [];
+    for (const el of document.querySelectorAll(selectors)) {
+        if (out.length >= maxItems) break;
+        if (el.tagName === 'A') {
+            const url = el.href || '';
+            if (!url.startsWith('http') || state.urls.has(url)) continue;
+            state.urls.add(url);
+            out.push({kind: 'source', url: url, text: (el.innerText || '').trim().slice(0, 200)});
+            continue;
+        }
+        // 只取最内层的匹配节点，避免 li > p 这样的嵌套重复
+        if (blockSelectors && el.querySelector(blockSelectors)) continue;
+        const text = (el.innerText || '').trim();
+        if (text.length < 3 || state.last.get(el) === text) continue;
+        const updated = state.last.has(el);
+        state.last.set(el, text);
+        out.push({kind: /^H[1-6]$/.test(el.tagName) ? 'section' : 'step', text: text.slice(0, 2000),
+                  updated: updated});
+    }
+    return JSON.stringify(out);
+})()
+'''
+
+
+class ProgressCapture:
+    """挂在等待循环上的进度采集器；maybe_poll 每被调用 every 次才真正拉取一次，
+    因此拉取频率只取决于等待循环本身（录制回放时也保持确定）"""
+
+    def __init__(self, output_dir, interval=20, check_interval=0.5, selectors=DEFAULT_SELECTORS,
+                 max_items=200, timeout=15, on_item=None, record_pid=True):
+        self.path = Path(output_dir) / PROGRESS_FILE
+        self.every = max(1, round(interval / check_interval))
+        self.selectors = selectors
+        self.max_items = max_items
+        self.timeout = timeout
+        self.on_item = on_item
+        self.items = 0
+        self.sources = 0
+        self._ticks = 0
+        self._seen = set()
+        self._tab = None
+        self._frame = None
+        # 浏览器重启后继续追加；start 记录中的 host/pid 供 `progress.py stop` 使用。
+        # 任务运行在长期存在的进程内（如 DeepResearchClient）时不记录 pid，该任务不能从外部终止
+        start = {"kind": "start", "host": socket.gethostname()}
+        if record_pid:
+            start["pid"] = os.getpid()
+        self._write(start)
+
+    @classmethod
+    def from_config(cls, config, output_dir, on_item=None, record_pid=True):
+        """按 config.yaml 的 progress 段创建；未启用时返回 None"""
+        settings = config.get('progress', {})
+        if not settings.get('enabled', True):
+            return None
+        return cls(output_dir,
+                   interval=settings.get('interval', 20),
+                   check_interval=config['timings']['button_check_interval'],
+                   selectors=settings.get('selectors', DEFAULT_SELECTORS),
+                   max_items=settings.get('max_items', 200),
+                   on_item=on_item,
+                   record_pid=record_pid)
+
+    def _write(self, entry):
+        entry = {"t": round(time.time(), 3), **entry}
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    async def maybe_poll(self, tab):
+        self._ticks += 1
+        if (self._ticks - 1) % self.every:
+            return 0
+        try:
+            return await self.poll(tab)
+        except Exception as e:
+            # 进度采集失败不影响主流程，下次重新定位 iframe
+            print(f"⚠️ 进度采集失败: {e!r}")
+            self._frame = None
+            return 0
+
+    async def _attach(self, tab):
+        """定位（或复用）最后一个 deep-research iframe 的子会话和内层 frame"""
+        if self._tab is not tab:
+            self._tab, self._frame = tab, None
+        if self._frame is not None and self._frame[0].attached:
+            return self._frame
+        # 只取属于本 tab 的 iframe；同一浏览器中并发的其他任务各有自己的 tab
+        outer_tid = await find_iframe_target(tab, 'deep_research')
+        if not outer_tid:
+            return None
+        session = await get_session_client(tab).attach(str(outer_tid), timeout=self.timeout)
+        tree = await session.send("Page.getFrameTree", timeout=self.timeout)
+        children = tree.get("frameTree", {}).get("childFrames", [])
+        if not children:
+            return None
+        self._frame = (session, children[0]["frame"]["id"])
+        return self._frame
+
+    def _block_selectors(self):
+        """去掉链接选择器后的部分，用于判断节点是否为最内层"""
+        parts = [s.strip() for s in self.selectors.split(",")]
+        return ", ".join(s for s in parts if s and s != "a" and not s.startswith("a["))
+
+    async def poll(self, tab):
+        """拉取一次，把新节点追加到 progress.jsonl，返回新增条数"""
+        frame = await self._attach(tab)
+        if frame is None:
+            return 0
+        session, frame_id = frame
+        try:
+            ctx_id = await session.isolated_world(frame_id, "progress_capture", timeout=self.timeout)
+            result = await session.send("Runtime.evaluate", {
+                "expression": COLLECT_JS % {"selectors": json.dumps(self.selectors),
+                                            "block_selectors": json.dumps(self._block_selectors()),
+                                            "max_items": self.max_items},
+                "contextId": ctx_id,
+                "returnByValue": True,
+            }, timeout=self.timeout)
+        except (CDPError, asyncio.TimeoutError):
+            self._frame = None
+            raise
+        value = (result.get("result") or {}).get("value")
+        count = 0
+        for item in json.loads(value or "[]"):
+            # isolated world 重建或节点重新渲染后，浏览器端状态会丢失，这里再去一次重
+            key = (item["kind"], item.get("url") or item.get("text"))
+            if key in self._seen:
+                continue
+            self._seen.add(key)
+            if not item.get("updated"):
+                item.pop("updated", None)
+            self._write(item)
+            count += 1
+            self.items += 1
+            if item["kind"] == "source":
+                self.sources += 1
+            if self.on_item is not None:
+                self.on_item(item)
+        return count
+
+
+def read_progress(job_dir):
+    """汇总一个任务的 progress.jsonl：条目数、来源数、最后一条内容、最后更新时间，以及最近一次启动的主机名和 pid"""
+    summary = {"items": 0, "sources": 0, "sections": 0, "last": None, "last_t": None, "host": None, "pid": None}
+    path = Path(job_dir) / PROGRESS_FILE
+    if not path.exists():
+        return summary
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get("kind") == "start":
+                summary["host"] = entry.get("host")
+                summary["pid"] = entry.get("pid")
+                continue
+            summary["items"] += 1
+            summary["sources"] += entry.get("kind") == "source"
+            summary["sections"] += entry.get("kind") == "section"
+            summary["last"] = entry
+            summary["last_t"] = entry.get("t")
+    return summary
+
+
+def pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def iter_job_status(root, include_finished=False):
+    """遍历 root 下所有任务目录（含 meta.json），返回运行中（或全部）任务的状态"""
+    for meta_path in sorted(Path(root).rglob("meta.json")):
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            continue
+        status = meta.get("status")
+        if status != "running" and not include_finished:
+            continue
+        job_dir = meta_path.parent
+        progress = read_progress(job_dir)
+        # 其他主机（分布式 worker 上传的结果）的 pid 在本机无意义，不做存活检查
+        if status == "running" and progress["pid"] and progress["host"] == socket.gethostname() \
+                and not pid_alive(progress["pid"]):
+            status = "dead"
+        yield {
+            "job": str(job_dir.relative_to(root)) if job_dir != Path(root) else job_dir.name,
+            "dir": job_dir,
+            "status": status,
+            "started_at": (meta.get("timings") or {}).get("started_at"),
+            **progress,
+        }
+
+
+def format_status(jobs, now=None):
+    now = now or time.time()
+    lines = [f"{'任务':<40} {'状态':<12} {'已运行':>6} {'条目':>5} {'来源':>5} {'更新':>6}  最新内容"]
+    for job in jobs:
+        elapsed = f"{(now - job['started_at']) / 60:.0f}m" if job["started_at"] else "-"
+        age = f"{now - job['last_t']:.0f}s" if job["last_t"] else "-"
+        last = job["last"] or {}
+        text = (last.get("url") or last.get("text") or "").replace("\n", " ")[:60]
+        lines.append(f"{job['job'][:40]:<40} {job['status']:<12} {elapsed:>6} {job['items']:>5} "
+                     f"{job['sources']:>5} {age:>6}  {text}")
+    return "\n".join(lines)
+
+
+def stop_job(job_dir):
+    """向运行该任务的进程发送 SIGTERM（run_DeepResearch 收到后退出并关闭浏览器，释放批处理中的并发槽位）。
+    只在任务仍为 running、由本机启动且记录了 pid 时发送，以免误杀 pid 已被复用的其他进程"""
+    try:
+        meta = json.loads((Path(job_dir) / "meta.json").read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        meta = {}
+    if meta.get("status") != "running":
+        print(f"⚠️ 任务未在运行 (status={meta.get('status')}): {job_dir}")
+        return False
+    progress = read_progress(job_dir)
+    pid, host = progress["pid"], progress["host"]
+    if host != socket.gethostname():
+        print(f"⚠️ 任务运行在其他主机 ({host})，无法在本机终止: {job_dir}")
+        return False
+    if not pid:
+        print(f"⚠️ 任务没有记录独立进程（运行在 Python API 的服务进程内），无法终止: {job_dir}")
+        return False
+    if not pid_alive(pid):
+        print(f"⚠️ 没有正在运行的进程: {job_dir}")
+        return False
+    os.kill(pid, signal.SIGTERM)
+    print(f"🛑 已发送 SIGTERM: pid={pid} ({job_dir})")
+    return True
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Deep Research 进度查看')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_status = sub.add_parser('status', help='显示目录下所有运行中任务的进度')
+    p_status.add_argument('root', nargs='?', default='response', help='批次或输出根目录 (默认: response)')
+    p_status.add_argument('--all', action='store_true', help='同时显示已结束的任务')
+    p_status.add_argument('--watch', type=int, default=None, metavar='SECONDS', help='每隔 N 秒刷新')
+
+    p_tail = sub.add_parser('tail', help='打印单个任务的进度记录')
+    p_tail.add_argument('job_dir', help='任务输出目录')
+    p_tail.add_argument('-n', type=int, default=20, help='显示最后 N 条 (默认: 20)')
+
+    p_stop = sub.add_parser('stop', help='终止运行中的任务')
+    p_stop.add_argument('job_dir', help='任务输出目录')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.command == 'stop':
+        sys.exit(0 if stop_job(args.job_dir) else 1)
+
+    if args.command == 'tail':
+        path = Path(args.job_dir) / PROGRESS_FILE
+        if not path.exists():
+            print(f"⚠️ 没有进度记录: {path}")
+            sys.exit(1)
+        with path.open("r", encoding="utf-8") as f:
+            lines = f.readlines()[-args.n:]
+        for line in lines:
+            entry = json.loads(line)
+            stamp = time.strftime("%H:%M:%S", time.localtime(entry["t"]))
+            body = entry.get("url") or entry.get("text") or f"host={entry.get('host')} pid={entry.get('pid')}"
+            print(f"{stamp} [{entry['kind']}] {body}")
+        return
+
+    while True:
+        jobs = list(iter_job_status(args.root, include_finished=args.all))
+        if args.watch:
+            print("\033[2J\033[H", end="")
+        print(format_status(jobs))
+        if not jobs:
+            print("（没有运行中的任务）")
+        if not args.watch:
+            return
+        try:
+            time.sleep(args.watch)
+        except KeyboardInterrupt:
+            return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""研究报告索引：把 response/ 下所有已完成任务汇总到单个 SQLite (FTS5) 库中，支持增量更新、全文检索与导出"""
+
+import argparse
+import json
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import yaml
+
+DEFAULT_DB_NAME = "reports.db"
+REPORT_FILES = ("output.md", "output.html", "url.txt", "meta.json")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id          INTEGER PRIMARY KEY,
+    rel_dir     TEXT UNIQUE NOT NULL,
+    batch       TEXT NOT NULL,
+    name        TEXT NOT NULL,
+    url         TEXT,
+    prompt      TEXT,
+    markdown    TEXT,
+    html        TEXT,
+    meta        TEXT,
+    status      TEXT,
+    started_at  REAL,
+    finished_at REAL,
+    duration    REAL,
+    signature   TEXT NOT NULL,
+    indexed_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reports_batch ON reports(batch);
+CREATE INDEX IF NOT EXISTS reports_status ON reports(status);
+CREATE INDEX IF NOT EXISTS reports_finished ON reports(finished_at);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS reports_fts USING fts5(
+    name, prompt, markdown,
+    content='reports', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS reports_ai AFTER INSERT ON reports BEGIN
+    INSERT INTO reports_fts(rowid, name, prompt, markdown)
+    VALUES (new.id, new.name, new.prompt, new.markdown);
+END;
+CREATE TRIGGER IF NOT EXISTS reports_ad AFTER DELETE ON reports BEGIN
+    INSERT INTO reports_fts(reports_fts, rowid, name, prompt, markdown)
+    VALUES ('delete', old.id, old.name, old.prompt, old.markdown);
+END;
+CREATE TRIGGER IF NOT EXISTS reports_au AFTER UPDATE ON reports BEGIN
+    INSERT INTO reports_fts(reports_fts, rowid, name, prompt, markdown)
+    VALUES ('delete', old.id, old.name, old.prompt, old.markdown);
+    INSERT INTO reports_fts(rowid, name, prompt, markdown)
+    VALUES (new.id, new.name, new.prompt, new.markdown);
+END;
+"""
+
+
+def connect(db_path):
+    """打开（必要时创建）索引库；WAL 模式允许批处理中多个进程同时写入"""
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_path), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def default_db_path(config, response_dir=None):
+    """索引库路径：response_dir 未指定或就是 config 的 output.base_dir 时使用 config['index']['db_path']；
+    其他结果目录一律用 <response_dir>/reports.db（rel_dir 是相对路径，不同目录树不能共用一个库）"""
+    config = config or {}
+    base = Path(config.get('output', {}).get('base_dir', 'response'))
+    if response_dir is None or Path(response_dir).resolve() == base.resolve():
+        db_path = config.get('index', {}).get('db_path')
+        if db_path:
+            return Path(db_path)
+        response_dir = base
+    return Path(response_dir) / DEFAULT_DB_NAME
+
+
+def report_signature(report_dir):
+    """由结果文件的 mtime/size 组成的签名，只 stat 不读内容"""
+    parts = []
+    for name in REPORT_FILES:
+        try:
+            st = (Path(report_dir) / name).stat()
+        except FileNotFoundError:
+            continue
+        parts.append(f"{name}:{st.st_mtime_ns}:{st.st_size}")
+    return "|".join(parts)
+
+
+def iter_report_dirs(response_dir):
+    """遍历 response/ 下所有包含 output.md 或 url.txt 的任务目录"""
+    response_dir = Path(response_dir)
+    seen = set()
+    for marker in ("output.md", "url.txt"):
+        for path in response_dir.rglob(marker):
+            report_dir = path.parent
+            if report_dir not in seen:
+                seen.add(report_dir)
+                yield report_dir
+
+
+def _read_text(path):
+    try:
+        return Path(path).read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    except UnicodeDecodeError:
+        return Path(path).read_text(encoding="utf-8", errors="replace")
+
+
+def load_report(report_dir):
+    """读取单个任务目录，返回待写入索引的字段"""
+    report_dir = Path(report_dir)
+    meta = {}
+    meta_text = _read_text(report_dir / "meta.json")
+    if meta_text:
+        try:
+            meta = json.loads(meta_text)
+        except json.JSONDecodeError:
+            meta = {}
+    url = _read_text(report_dir / "url.txt")
+    markdown = _read_text(report_dir / "output.md")
+    timings = meta.get('timings', {})
+    started_at = timings.get('started_at')
+    finished_at = timings.get('finished_at')
+    if finished_at is None and markdown is not None:
+        finished_at = (report_dir / "output.md").stat().st_mtime
+    status = meta.get('status') or ("completed" if markdown else "incomplete")
+    return {
+        'url': url.strip() if url else (meta.get('url') or None),
+        'prompt': meta.get('prompt'),
+        'markdown': markdown,
+        'html': _read_text(report_dir / "output.html"),
+        'meta': json.dumps(meta, ensure_ascii=False) if meta else None,
+        'status': status,
+        'started_at': started_at,
+        'finished_at': finished_at,
+        'duration': (finished_at - started_at) if started_at and finished_at else None,
+    }
+
+
+def _split_rel_dir(rel_dir):
+    parts = Path(rel_dir).parts
+    batch = parts[0] if len(parts) > 1 else ""
+    return batch, parts[-1]
+
+
+def index_report(conn, response_dir, report_dir, signature=None):
+    """把单个任务目录写入索引（已存在则覆盖），返回 True 表示有更新"""
+    response_dir = Path(response_dir).resolve()
+    report_dir = Path(report_dir).resolve()
+    rel_dir = report_dir.relative_to(response_dir).as_posix()
+    if signature is None:
+        signature = report_signature(report_dir)
+    row = conn.execute("SELECT signature FROM reports WHERE rel_dir = ?", (rel_dir,)).fetchone()
+    if row is not None and row['signature'] == signature:
+        return False
+    batch, name = _split_rel_dir(rel_dir)
+    fields = load_report(report_dir)
+    fields.update(rel_dir=rel_dir, batch=batch, name=name, signature=signature, indexed_at=time.time())
+    columns = ", ".join(fields)
+    placeholders = ", ".join(f":{k}" for k in fields)
+    updates = ", ".join(f"{k} = excluded.{k}" for k in fields if k != 'rel_dir')
+    conn.execute(
+        f"INSERT INTO reports ({columns}) VALUES ({placeholders}) "
+        f"ON CONFLICT(rel_dir) DO UPDATE SET {updates}",
+        fields,
+    )
+    return True
+
+
+def reindex(conn, response_dir, prune=True):
+    """增量重建索引：签名未变的目录不读文件；prune 时删除磁盘上已不存在的条目"""
+    response_dir = Path(response_dir).resolve()
+    known = {r['rel_dir']: r['signature'] for r in conn.execute("SELECT rel_dir, signature FROM reports")}
+    updated = 0
+    present = set()
+    with conn:
+        for report_dir in iter_report_dirs(response_dir):
+            report_dir = report_dir.resolve()
+            rel_dir = report_dir.relative_to(response_dir).as_posix()
+            present.add(rel_dir)
+            signature = report_signature(report_dir)
+            if known.get(rel_dir) == signature:
+                continue
+            if index_report(conn, response_dir, report_dir, signature):
+                updated += 1
+        removed = 0
+        if prune:
+            for rel_dir in set(known) - present:
+                conn.execute("DELETE FROM reports WHERE rel_dir = ?", (rel_dir,))
+                removed += 1
+    return updated, removed
+
+
+def update_index(config, output_dir, response_dir=None):
+    """任务结束后调用：把刚完成的任务目录增量写入索引，失败不影响主流程"""
+    try:
+        output_dir = Path(output_dir).resolve()
+        if response_dir is None:
+            # 批处理时 output_dir 为 <base>/<batch>/<prompt>，单任务时为 <base>/<prompt>
+            base = Path(config['output']['base_dir']).resolve()
+            response_dir = base if base in output_dir.parents else output_dir.parent
+        conn = connect(default_db_path(config, response_dir))
+        try:
+            with conn:
+                index_report(conn, response_dir, output_dir)
+        finally:
+            conn.close()
+        print(f"🗂️ 已更新报告索引: {output_dir.name}")
+    except Exception as e:
+        print(f"⚠️ 报告索引更新失败: {e}")
+
+
+def _split_query(text):
+    """拆分检索词：trigram 分词器只能匹配 >= 3 字符的词，更短的词（如两字中文词）改用 LIKE 过滤。
+    已含 FTS 语法时整体原样交给 FTS5"""
+    if any(op in text for op in ('"', ' OR ', ' AND ', ' NOT ', 'NEAR(')):
+        return text, []
+    terms = [t for t in text.split() if t]
+    long_terms = [t for t in terms if len(t) >= 3]
+    short_terms = [t for t in terms if len(t) < 3]
+    fts = " ".join('"' + t.replace('"', '""') + '"' for t in long_terms)
+    return fts, short_terms
+
+
+def search(conn, query=None, batch=None, status=None, since=None, url=None, limit=20):
+    """按相关度（bm25）排序的全文检索，可与元数据条件组合；query 为空时只按元数据过滤"""
+    where, params = [], []
+    if batch:
+        where.append("r.batch = ?")
+        params.append(batch)
+    if status:
+        where.append("r.status = ?")
+        params.append(status)
+    if since:
+        where.append("r.finished_at >= ?")
+        params.append(since)
+    if url:
+        where.append("r.url LIKE ?")
+        params.append(f"%{url}%")
+    fts, short_terms = _split_query(query) if query else ("", [])
+    for term in short_terms:
+        where.append("(r.name LIKE ? OR r.prompt LIKE ? OR r.markdown LIKE ?)")
+        params.extend([f"%{term}%"] * 3)
+    if fts:
+        # 标题 > 提示 > 正文 的权重
+        sql = (
+            "SELECT r.id, r.rel_dir, r.batch, r.name, r.url, r.status, r.finished_at, r.duration, "
+            "bm25(reports_fts, 10.0, 4.0, 1.0) AS rank, "
+            "snippet(reports_fts, 2, '[', ']', ' … ', 16) AS snippet "
+            "FROM reports_fts JOIN reports r ON r.id = reports_fts.rowid "
+            "WHERE reports_fts MATCH ?"
+        )
+        params.insert(0, fts)
+        if where:
+            sql += " AND " + " AND ".join(where)
+        sql += " ORDER BY rank LIMIT ?"
+    else:
+        sql = (
+            "SELECT r.id, r.rel_dir, r.batch, r.name, r.url, r.status, r.finished_at, r.duration, "
+            "NULL AS rank, substr(r.markdown, 1, 120) AS snippet FROM reports r"
+        )
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY r.finished_at DESC LIMIT ?"
+    params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+
+def export_reports(conn, dest_dir, rel_dirs=None):
+    """把索引中的报告导出为原有目录结构 <dest>/<batch>/<prompt>/{output.md,output.html,url.txt,meta.json}"""
+    dest_dir = Path(dest_dir)
+    sql = "SELECT rel_dir, url, markdown, html, meta FROM reports"
+    params = []
+    if rel_dirs is not None:
+        rel_dirs = list(rel_dirs)
+        if not rel_dirs:
+            return 0
+        sql += f" WHERE rel_dir IN ({', '.join('?' * len(rel_dirs))})"
+        params = rel_dirs
+    count = 0
+    for row in conn.execute(sql, params):
+        out = dest_dir / row['rel_dir']
+        out.mkdir(parents=True, exist_ok=True)
+        for filename, value in (("output.md", row['markdown']), ("output.html", row['html']),
+                                ("url.txt", row['url']), ("meta.json", row['meta'])):
+            if value is not None:
+                (out / filename).write_text(value, encoding="utf-8")
+        count += 1
+    return count
+
+
+def _format_time(ts):
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(ts)) if ts else "-"
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Deep Research 报告索引与全文检索')
+    parser.add_argument('--config', type=str, default='config.yaml',
+                        help='配置文件路径 (默认: config.yaml)')
+    parser.add_argument('--response_dir', type=str, default=None,
+                        help='结果根目录 (默认: config 中的 output.base_dir)')
+    parser.add_argument('--db', type=str, default=None,
+                        help='索引库路径 (默认: <response_dir>/reports.db)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_index = sub.add_parser('index', help='增量更新索引')
+    p_index.add_argument('--no-prune', action='store_true', help='保留磁盘上已删除任务的索引条目')
+
+    p_search = sub.add_parser('search', help='全文检索 / 元数据查询')
+    p_search.add_argument('query', nargs='?', default=None, help='检索词（FTS5 语法）')
+    p_search.add_argument('--batch', type=str, default=None, help='只查指定批次')
+    p_search.add_argument('--status', type=str, default=None, help='只查指定状态')
+    p_search.add_argument('--url', type=str, default=None, help='会话 URL 包含的字符串')
+    p_search.add_argument('--days', type=float, default=None, help='只查最近 N 天完成的任务')
+    p_search.add_argument('--limit', type=int, default=20, help='返回条数 (默认: 20)')
+    p_search.add_argument('--json', action='store_true', help='以 JSON 输出')
+
+    p_export = sub.add_parser('export', help='导出为原有目录结构')
+    p_export.add_argument('dest', help='导出目标目录')
+    p_export.add_argument('--query', type=str, default=None, help='只导出匹配的报告')
+    p_export.add_argument('--batch', type=str, default=None, help='只导出指定批次')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    config = {}
+    if Path(args.config).exists():
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f) or {}
+    response_dir = Path(args.response_dir or config.get('output', {}).get('base_dir', 'response'))
+    db_path = Path(args.db) if args.db else default_db_path(config, response_dir)
+    conn = connect(db_path)
+
+    if args.command == 'index':
+        if not response_dir.is_dir():
+            print(f"⚠️ 结果目录 '{response_dir}' 不存在")
+            sys.exit(1)
+        start = time.perf_counter()
+        updated, removed = reindex(conn, response_dir, prune=not args.no_prune)
+        total = conn.execute("SELECT count(*) FROM reports").fetchone()[0]
+        print(f"🗂️ 索引完成: 更新 {updated} 个, 删除 {removed} 个, 共 {total} 个报告 "
+              f"({time.perf_counter() - start:.2f}s) -> {db_path}")
+
+    elif args.command == 'search':
+        since = time.time() - args.days * 86400 if args.days else None
+        start = time.perf_counter()
+        rows = search(conn, args.query, batch=args.batch, status=args.status,
+                      since=since, url=args.url, limit=args.limit)
+        elapsed = (time.perf_counter() - start) * 1000
+        if args.json:
+            print(json.dumps([dict(r) for r in rows], ensure_ascii=False, indent=2))
+        else:
+            for r in rows:
+                print(f"{r['rel_dir']}  [{r['status']}]  {_format_time(r['finished_at'])}  {r['url'] or ''}")
+                if r['snippet']:
+                    print(f"    {' '.join(r['snippet'].split())}")
+            print(f"🔍 {len(rows)} 条结果 ({elapsed:.1f} ms)")
+
+    elif args.command == 'export':
+        rel_dirs = None
+        if args.query or args.batch:
+            rows = search(conn, args.query, batch=args.batch, limit=-1)
+            rel_dirs = [r['rel_dir'] for r in rows]
+        count = export_reports(conn, args.dest, rel_dirs)
+        print(f"💾 已导出 {count} 个报告到 {args.dest}")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,12 +8,22 @@ import json
 import glob
 import shutil
 import os
+import signal
+import sys
+import time
 from pathlib import Path
 from nodriver.cdp.input_ import dispatch_key_event
 from nodriver.cdp import input_ as cdp_input
 from nodriver.cdp import page as cdp_page
 from nodriver.cdp import runtime as cdp_runtime
-from nodriver.cdp import target as cdp_target
+from report_index import update_index
+from citations import save_citations
+from cdp_replay import CDPRecorder
+from cdp_session import CDPError, find_iframe_target, get_session_client, close_session_client
+from browser_watchdog import BrowserFailure, BrowserWatchdog, restart_browser
+from progress import ProgressCapture
+
+DOWNLOAD_DIR = "/root/Downloads"
 
 def sanitize_path(path_str):
     invalid_chars = r'<>:"/\\|?*'
@@ -24,9 +34,9 @@ def sanitize_path(path_str):
         path_str = "unnamed_output"
     return path_str
 
-def setup_output_directory(config, prompt_path, output_dir):
+def setup_output_directory(config, prompt_path, output_dir, name=None):
     prompt_path = Path(prompt_path)
-    prompt_filename = sanitize_path(prompt_path.stem)
+    prompt_filename = sanitize_path(name if name is not None else prompt_path.stem)
     if output_dir is None:
         output_dir = Path(config['output']['base_dir']) / prompt_filename
     else:
@@ -53,41 +63,38 @@ async def send_text_with_newlines(tab, textarea, text, is_shift=True):
                 await tab.send(dispatch_key_event(type_='keyUp', modifiers=8, windows_virtual_key_code=13, key="Enter", code="Enter"))
 
 
-async def main(config_path="config.yaml", prompt_path=None, output_dir=None):
-    config_path = Path(config_path)
-    with config_path.open("r", encoding="utf-8") as f:
-        config = yaml.safe_load(f)
-
-    if prompt_path is None:
-        prompt_path = Path(config['prompt']['default_path'])
-    else:
-        prompt_path = Path(prompt_path)
-
-    if not prompt_path.exists():
-        print(f"⚠️ 提示文件 '{prompt_path}' 不存在")
-        return
-
-    output_dir, html_path, md_path = setup_output_directory(config, prompt_path, output_dir)
-    print(f"📂 输出目录: {output_dir}")
-
-    with prompt_path.open("r", encoding=config['prompt']['encoding']) as f:
-        prompt_text = f.read()
-
-    # 清空下载目录
-    download_dir = "/root/Downloads"
-    Path(download_dir).mkdir(parents=True, exist_ok=True)
-    for f in glob.glob(f"{download_dir}/*.md"):
-        os.remove(f)
-
-    # 启动浏览器
-    browser = await uc.start(headless=config['browser']['headless'])
-    await browser.cookies.load()
+def save_meta(output_dir, prompt_path, prompt_text, timings, status, url=None):
+    """保存任务元数据 (meta.json)：提示内容、各阶段时间戳和最终状态，供报告索引使用"""
+    meta = {
+        "prompt_path": str(prompt_path),
+        "prompt": prompt_text,
+        "url": url,
+        "status": status,
+        "timings": timings,
+    }
+    meta_path = Path(output_dir) / "meta.json"
+    with meta_path.open("w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta_path
+
+
+async def save_conversation_url(tab, output_dir, wait=0):
+    """读取当前会话 URL 并写入 url.txt；wait > 0 时最多等待 wait 秒直到出现 /c/<id> 形式的会话 URL"""
+    deadline = time.monotonic() + wait
+    while True:
+        url_str = str(await tab.evaluate('window.location.href'))
+        if '/c/' in url_str or time.monotonic() >= deadline:
+            break
+        await tab.sleep(2)
+    url_txt_path = Path(output_dir) / "url.txt"
+    with url_txt_path.open("w", encoding="utf-8") as f:
+        f.write(url_str)
+    print(f"💾 URL 已保存: {url_txt_path}")
+    return url_str
 
-    tab = await browser.get(config['urls']['chatgpt'])
-    # 全屏浏览器窗口
-    await tab.maximize()
-    await tab.sleep(config['timings']['initial_wait'])
 
+async def open_deep_research(tab, config):
+    """切换到 Deep Research 模式并找到输入框所在容器，返回 (container, status)；失败时 container 为 None"""
     # 1. 点击侧边栏 Deep Research 进入模式
     print("🔍 切换到 Deep Research 模式...")
     deep_research_button = await tab.find(config['buttons']['deep_research'], best_match=True)
@@ -97,9 +104,7 @@ async def main(config_path="config.yaml", prompt_path=None, output_dir=None):
         print("✅ 已切换到 Deep Research 模式")
     else:
         print("⚠️ 未找到 Deep Research 按钮")
-        await browser.cookies.save()
-        browser.stop()
-        return
+        return None, "deep_research_button_missing"
 
     # 2. 查找输入框
     await tab.sleep(3)
@@ -114,9 +119,7 @@ async def main(config_path="config.yaml", prompt_path=None, output_dir=None):
             continue
     if not elem:
         print("⚠️ 未找到输入框")
-        await browser.cookies.save()
-        browser.stop()
-        return
+        return None, "input_missing"
     await elem.update()
 
     # 查找父容器
@@ -131,7 +134,11 @@ async def main(config_path="config.yaml", prompt_path=None, output_dir=None):
         await elem.update()
         container = elem
         await container.update()
+    return container, None
+
 
+async def submit_prompt(tab, config, container, prompt_text):
+    """输入提示文本并点击发送，返回是否已发送"""
     # 3. 输入提示文本并发送
     textarea = await container.query_selector('textarea')
     await send_text_with_newlines(tab, textarea, prompt_text)
@@ -148,32 +155,48 @@ async def main(config_path="config.yaml", prompt_path=None, output_dir=None):
     if send_button:
         await send_button.click()
         print("📤 提示已发送")
-    else:
-        print("⚠️ 未找到发送按钮")
-        await browser.cookies.save()
-        browser.stop()
-        return
-    await tab.sleep(config['timings']['initial_wait'])
-
-    # 4. 等待 Deep Research 完成
-    print("⏳ 等待 Deep Research 完成...")
-    await wait_for_deep_research(tab, config)
+        return True
+    print("⚠️ 未找到发送按钮")
+    return False
 
-    # 5. 保存 URL
-    current_url = await tab.evaluate('window.location.href')
-    url_str = str(current_url)
-    url_txt_path = Path(output_dir) / "url.txt"
-    with url_txt_path.open("w", encoding="utf-8") as f:
-        f.write(url_str)
-    print(f"💾 URL 已保存: {url_txt_path}")
 
-    # 6. 等待 iframe 内容完全加载
+async def wait_with_recovery(browser, tab, config, url_str, reopen, baseline=0, progress=None):
+    """等待 Deep Research 完成；看门狗检测到浏览器崩溃/卡死时调用 reopen(browser, tab, reason) 取得新的
+    (browser, tab) 并继续等待。返回 (research_done, browser, tab, restarts, failure)，
+    failure 为无法恢复的浏览器故障原因（正常结束或超时为 None）"""
+    print("⏳ 等待 Deep Research 完成...")
+    watchdog_enabled = config.get('watchdog', {}).get('enabled', True)
+    max_restarts = config.get('watchdog', {}).get('max_restarts', 3)
+    restarts = 0
+    resume = False
+    while True:
+        watchdog = await BrowserWatchdog(browser, tab, config).start() if watchdog_enabled else None
+        try:
+            research_done = await wait_for_deep_research(tab, config, watchdog=watchdog, resume=resume,
+                                                         baseline=baseline, progress=progress)
+            return research_done, browser, tab, restarts, None
+        except Exception as e:
+            reason = e.reason if isinstance(e, BrowserFailure) else (watchdog and await watchdog.check())
+            if not reason:
+                raise
+            if restarts >= max_restarts or '/c/' not in url_str:
+                print(f"❌ 浏览器异常 ({reason})，无法恢复")
+                return False, browser, tab, restarts, reason
+            restarts += 1
+            print(f"💥 浏览器异常 ({reason})，重启浏览器并打开 {url_str} 继续等待 ({restarts}/{max_restarts})")
+            browser, tab = await reopen(browser, tab, reason)
+            resume = True
+
+
+async def harvest_report(tab, config, md_path, html_path, download_dir=DOWNLOAD_DIR):
+    """下载研究报告 Markdown（依次尝试 iframe 下载按钮、CDP 提取、剪贴板）并保存 HTML，返回是否得到有效 Markdown"""
+    # 7. 等待 iframe 内容完全加载
     print("📥 等待 iframe 内容加载...")
     await tab.sleep(10)
 
-    # 7. 通过点击 iframe 内下载按钮获取 Markdown
+    # 8. 通过点击 iframe 内下载按钮获取 Markdown
     print("📥 正在下载研究报告...")
-    downloaded = await download_from_iframe(tab, config, md_path)
+    downloaded = await download_from_iframe(tab, config, md_path, download_dir)
 
     # 验证下载内容是否有效
     if downloaded and not is_valid_markdown(md_path):
@@ -182,32 +205,179 @@ async def main(config_path="config.yaml", prompt_path=None, output_dir=None):
 
     if not downloaded:
         print("📥 尝试通过 CDP 直接从 iframe 提取内容...")
-        downloaded = await extract_markdown_from_iframe(tab, config, md_path)
+        downloaded = await extract_markdown_from_iframe(tab, config, md_path, download_dir)
 
     if not downloaded:
         print("⚠️ CDP 提取失败，尝试剪贴板方式...")
-        await fallback_copy_result(tab, config, md_path)
+        downloaded = await fallback_copy_result(tab, config, md_path)
 
-    # 7. 保存 HTML
+    downloaded = bool(downloaded) and is_valid_markdown(md_path)
+    # 提取引用来源
+    if downloaded:
+        save_citations(md_path)
+
+    # 9. 保存 HTML
     try:
         articles = await tab.select_all(config['selectors']['main_article'])
         if articles:
             last_article = articles[-1]
             html_content = await last_article.get_html()
-            with html_path.open("w", encoding="utf-8") as f:
+            with Path(html_path).open("w", encoding="utf-8") as f:
                 f.write(html_content)
             print(f"💾 HTML 已保存: {html_path}")
     except Exception as e:
         print(f"⚠️ HTML 保存失败: {e}")
+    return downloaded
+
+
+# final_status 中表示得到了可用报告的状态（批处理、流水线和协调器共用）
+SUCCESS_STATUSES = frozenset({"completed", "completed_after_timeout"})
+
+
+def final_status(downloaded, research_done, failure=None):
+    if downloaded:
+        return "completed" if research_done else "completed_after_timeout"
+    if failure:
+        return "browser_failed"
+    return "timeout" if not research_done else "download_failed"
 
-    # 保存 cookie 并退出
-    await browser.cookies.save()
-    browser.stop()
-    print("✅ 完成！")
 
+async def main(config_path="config.yaml", prompt_path=None, output_dir=None, record_cdp=None,
+               prompt_text=None, name=None, conversation_url=None, index=True, resume_url=None,
+               download_dir=DOWNLOAD_DIR):
+    """prompt_text 不为 None 时直接使用该文本（不读提示文件），输出子目录名取 name；
+    指定 conversation_url 时在该会话中继续提问，而不是新建会话；
+    指定 resume_url 时不再提交，只打开该会话等待已提交的研究完成并取回报告；index 为 False 时不写报告索引；
+    download_dir 为浏览器的下载目录（回放时换成临时目录）"""
+    config_path = Path(config_path)
+    with config_path.open("r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+
+    if prompt_text is None:
+        if prompt_path is None:
+            prompt_path = Path(config['prompt']['default_path'])
+        else:
+            prompt_path = Path(prompt_path)
+
+        if not prompt_path.exists():
+            print(f"⚠️ 提示文件 '{prompt_path}' 不存在")
+            return
+        with prompt_path.open("r", encoding=config['prompt']['encoding']) as f:
+            prompt_text = f.read()
+    else:
+        name = name or "prompt"
+        prompt_path = Path(f"<stdin:{name}>")
+
+    output_dir, html_path, md_path = setup_output_directory(config, prompt_path, output_dir, name=name)
+    print(f"📂 输出目录: {output_dir}")
 
-async def check_iframe_research_completed(tab):
-    """检查 iframe 内是否出现 'Research completed' 文本"""
+    timings = {"started_at": time.time()}
+
+    # 清空下载目录
+    Path(download_dir).mkdir(parents=True, exist_ok=True)
+    for f in glob.glob(f"{download_dir}/*.md"):
+        os.remove(f)
+
+    # 启动浏览器
+    browser = await uc.start(headless=config['browser']['headless'])
+    await browser.cookies.load()
+
+    tab = await browser.get(resume_url or conversation_url or config['urls']['chatgpt'])
+    recorder = CDPRecorder(record_cdp, download_dir=download_dir) if record_cdp else None
+    # 录制会替换全局的事件解析函数，无论以何种方式结束都要还原
+    try:
+        if recorder:
+            recorder.attach(tab)
+        # 全屏浏览器窗口
+        await tab.maximize()
+        await tab.sleep(config['timings']['initial_wait'])
+        baseline = await count_completed_reports(tab) if conversation_url and not resume_url else 0
+
+        if resume_url:
+            # 研究已在该会话中提交（例如上一个 worker 中途退出），直接继续等待
+            print(f"🔁 继续等待已提交的会话: {resume_url}")
+            timings["resumed_at"] = time.time()
+        else:
+            # 1-3. 切换到 Deep Research 模式，输入提示并发送
+            container, status = await open_deep_research(tab, config)
+            if container is not None and not await submit_prompt(tab, config, container, prompt_text):
+                status = "send_button_missing"
+            if status:
+                await browser.cookies.save()
+                browser.stop()
+                timings["finished_at"] = time.time()
+                save_meta(output_dir, prompt_path, prompt_text, timings, status)
+                return
+            timings["sent_at"] = time.time()
+            await tab.sleep(config['timings']['initial_wait'])
+
+        # 4. 在长时间等待之前保存会话 URL，浏览器崩溃后可据此恢复而无需重新提交
+        url_str = await save_conversation_url(tab, output_dir, wait=30)
+        save_meta(output_dir, prompt_path, prompt_text, timings, "running", url_str)
+
+        # 5. 等待 Deep Research 完成（看门狗检测到浏览器崩溃/卡死时重启并从会话 URL 继续等待），期间记录进度到 progress.jsonl
+        async def reopen(browser, tab, reason):
+            browser, tab = await restart_browser(browser, tab, config, url_str)
+            if recorder:
+                recorder.attach(tab)
+            return browser, tab
+
+        progress = ProgressCapture.from_config(config, output_dir)
+        research_done, browser, tab, restarts, failure = await wait_with_recovery(
+            browser, tab, config, url_str, reopen, baseline=baseline, progress=progress)
+        timings["research_done_at"] = time.time()
+        if restarts:
+            timings["browser_restarts"] = restarts
+
+        downloaded = False
+        if failure:
+            # 浏览器已无法使用，跳过下载；会话 URL 已保存，可稍后手动取回报告
+            timings["browser_failure"] = failure
+            try:
+                browser.stop()
+            except Exception:
+                pass
+        else:
+            # 6. 更新 URL（完成后可能有变化）
+            url_str = await save_conversation_url(tab, output_dir)
+
+            # 7-9. 获取 Markdown 和 HTML
+            downloaded = await harvest_report(tab, config, md_path, html_path, download_dir)
+            timings["downloaded_at"] = time.time()
+
+            # detach iframe 会话，保存 cookie 并退出
+            await close_session_client(tab)
+            await browser.cookies.save()
+            browser.stop()
+
+        # 保存元数据并更新报告索引
+        timings["finished_at"] = time.time()
+        save_meta(output_dir, prompt_path, prompt_text, timings,
+                  final_status(downloaded, research_done, failure), url_str)
+        if index:
+            update_index(config, output_dir)
+        print("✅ 完成！")
+    finally:
+        if recorder:
+            recorder.close()
+
+
+async def count_completed_reports(tab):
+    """统计页面上已有的 'Research completed' 次数（在已有会话中继续提问时，作为判断新报告完成的基线）"""
+    try:
+        result = await tab.evaluate('''
+            (() => {
+                let body = document.body ? document.body.innerText : '';
+                return body.split('Research completed').length - 1;
+            })()
+        ''')
+        return int(result or 0)
+    except Exception:
+        return 0
+
+
+async def check_iframe_research_completed(tab, baseline=0):
+    """检查 iframe 内是否出现 'Research completed' 文本（出现次数需超过 baseline）"""
     try:
         result = await tab.evaluate('''
             (() => {
@@ -215,75 +385,106 @@ async def check_iframe_research_completed(tab):
                 if (iframes.length === 0) return false;
                 // 检查页面上是否有 Research completed 文本
                 let body = document.body ? document.body.innerText : '';
-                return body.includes('Research completed');
+                return body.split('Research completed').length - 1 > %d;
             })()
-        ''')
+        ''' % baseline)
         return result == True
     except Exception:
         return False
 
 
-async def wait_for_deep_research(tab, config):
-    """等待 Deep Research 完成（通过检测 iframe 内 'Research completed' 或输入框/语音按钮重新出现）"""
+async def detect_completion(tab, config, baseline=0, check_iframe_height=True):
+    """执行一轮完成检测，已完成时返回 (检测方式, 完成后再等待的秒数)，否则返回 None"""
+    await tab
+    # 检测方式1: iframe 内出现 "Research completed" 文本
+    if await check_iframe_research_completed(tab, baseline):
+        return "检测到 'Research completed'", 5
+
+    # 检测方式2: speech 按钮或 send 按钮重新出现
+    speech_button = await tab.query_selector(config['selectors']['speech_button'])
+    send_button = await tab.query_selector(config['selectors']['send_button'])
+    if speech_button is not None or send_button is not None:
+        return "检测到按钮", 10
+
+    # 检测方式3: 最后一个 assistant turn 中有 copy 按钮
+    # （用户 turn 也可能有 copy 按钮，所以必须检查最后一个 turn 是 assistant 的）
+    completed = await tab.evaluate('''
+        (() => {
+            var turns = document.querySelectorAll('[data-testid^="conversation-turn-"]');
+            if (turns.length < 2) return false;
+            var lastTurn = turns[turns.length - 1];
+            // assistant turn 包含 class="agent-turn" 的元素
+            var isAssistant = lastTurn.querySelector('.agent-turn') !== null;
+            var hasCopy = lastTurn.querySelector('[data-testid="copy-turn-action-button"]') !== null;
+            return isAssistant && hasCopy;
+        })()
+    ''')
+    if completed == True:
+        return "检测到 assistant turn copy 按钮", 5
+
+    # 检测方式4: iframe 高度 > 100（内容已渲染）
+    if check_iframe_height:
+        iframe_ready = await tab.evaluate('''
+            (() => {
+                var iframes = document.querySelectorAll('iframe[title="internal://deep-research"]');
+                if (iframes.length === 0) return false;
+                var iframe = iframes[iframes.length - 1];
+                var h = iframe.getBoundingClientRect().height;
+                // 高度 > 100 且页面上有新的 "Research completed" 文本
+                var text = document.body ? document.body.innerText : '';
+                return h > 100 && text.split('Research completed').length - 1 > %d;
+            })()
+        ''' % baseline)
+        if iframe_ready == True:
+            return "检测到 iframe 已渲染", 5
+    return None
+
+
+async def wait_for_deep_research(tab, config, watchdog=None, resume=False, baseline=0, progress=None):
+    """等待 Deep Research 完成（通过检测 iframe 内 'Research completed' 或输入框/语音按钮重新出现）。
+    传入 watchdog 时检测到浏览器故障会抛出 BrowserFailure；resume 为 True 表示浏览器重启后继续等待；
+    baseline 为提交前页面上已有的已完成报告数；传入 progress (ProgressCapture) 时低频记录 iframe 中的进度。
+    nodriver 的命令没有超时，每轮检测限时 probe_timeout 秒，renderer 卡死时不会永远阻塞在某个 evaluate 上"""
     max_wait = int(config['timings']['max_wait_time'] / config['timings']['button_check_interval'])
+    pass_timeout = config.get('watchdog', {}).get('probe_timeout', 15)
+
+    async def run_pass(check_iframe_height):
+        """返回 True 表示已完成；检测超时在有看门狗时抛出 BrowserFailure"""
+        if watchdog:
+            await watchdog.raise_if_failed()
+        if progress:
+            await progress.maybe_poll(tab)
+        try:
+            detected = await asyncio.wait_for(
+                detect_completion(tab, config, baseline, check_iframe_height), timeout=pass_timeout)
+        except asyncio.TimeoutError:
+            if watchdog:
+                raise BrowserFailure(f"renderer hang (检测 > {pass_timeout}s)")
+            print(f"⚠️ 检测超时 (> {pass_timeout}s)")
+            return False
+        if detected:
+            how, settle = detected
+            await tab.sleep(settle)
+            print(f"✅ Deep Research 已完成 ({how})")
+            return True
+        return False
+
     elapsed = 0
     # Deep Research 至少需要几分钟
-    print("  等待中（至少 60 秒）...")
-    await tab.sleep(60)
+    if not resume:
+        print("  等待中（至少 60 秒）...")
+        await tab.sleep(60)
 
     while elapsed < max_wait:
         try:
-            await tab
-            # 检测方式1: iframe 内出现 "Research completed" 文本
-            if await check_iframe_research_completed(tab):
-                await tab.sleep(5)
-                print("✅ Deep Research 已完成 (检测到 'Research completed')")
-                return True
-
-            # 检测方式2: speech 按钮或 send 按钮重新出现
-            speech_button = await tab.query_selector(config['selectors']['speech_button'])
-            send_button = await tab.query_selector(config['selectors']['send_button'])
-            if speech_button is not None or send_button is not None:
-                await tab.sleep(10)
-                print("✅ Deep Research 已完成 (检测到按钮)")
-                return True
-
-            # 检测方式3: 最后一个 assistant turn 中有 copy 按钮
-            # （用户 turn 也可能有 copy 按钮，所以必须检查最后一个 turn 是 assistant 的）
-            completed = await tab.evaluate('''
-                (() => {
-                    var turns = document.querySelectorAll('[data-testid^="conversation-turn-"]');
-                    if (turns.length < 2) return false;
-                    var lastTurn = turns[turns.length - 1];
-                    // assistant turn 包含 class="agent-turn" 的元素
-                    var isAssistant = lastTurn.querySelector('.agent-turn') !== null;
-                    var hasCopy = lastTurn.querySelector('[data-testid="copy-turn-action-button"]') !== null;
-                    return isAssistant && hasCopy;
-                })()
-            ''')
-            if completed == True:
-                await tab.sleep(5)
-                print("✅ Deep Research 已完成 (检测到 assistant turn copy 按钮)")
-                return True
-
-            # 检测方式4: iframe 高度 > 100（内容已渲染）
-            iframe_ready = await tab.evaluate('''
-                (() => {
-                    var iframes = document.querySelectorAll('iframe[title="internal://deep-research"]');
-                    if (iframes.length === 0) return false;
-                    var iframe = iframes[iframes.length - 1];
-                    var h = iframe.getBoundingClientRect().height;
-                    // 高度 > 100 且页面上有 "Research completed" 文本
-                    var text = document.body ? document.body.innerText : '';
-                    return h > 100 && text.includes('Research completed');
-                })()
-            ''')
-            if iframe_ready == True:
-                await tab.sleep(5)
-                print("✅ Deep Research 已完成 (检测到 iframe 已渲染)")
+            if await run_pass(check_iframe_height=True):
                 return True
+        except BrowserFailure:
+            raise
         except Exception as e:
             print(f"⚠️ 检测错误: {e}")
+            if watchdog:
+                await watchdog.raise_if_failed(force=True)
 
         await tab.sleep(config['timings']['button_check_interval'])
         elapsed += 1
@@ -294,40 +495,23 @@ async def wait_for_deep_research(tab, config):
 
     # 超时后 reload 重试
     print("⏳ 首次等待超时，刷新页面重试...")
-    await tab.reload()
+    try:
+        await asyncio.wait_for(tab.reload(), timeout=pass_timeout)
+    except asyncio.TimeoutError:
+        if watchdog:
+            raise BrowserFailure(f"renderer hang (reload > {pass_timeout}s)")
     await tab.sleep(15)
     elapsed = 0
     while elapsed < max_wait:
         try:
-            await tab
-            if await check_iframe_research_completed(tab):
-                await tab.sleep(5)
-                print("✅ Deep Research 已完成 (检测到 'Research completed')")
-                return True
-
-            speech_button = await tab.query_selector(config['selectors']['speech_button'])
-            send_button = await tab.query_selector(config['selectors']['send_button'])
-            if speech_button is not None or send_button is not None:
-                await tab.sleep(10)
-                print("✅ Deep Research 已完成 (检测到按钮)")
-                return True
-
-            completed = await tab.evaluate('''
-                (() => {
-                    var turns = document.querySelectorAll('[data-testid^="conversation-turn-"]');
-                    if (turns.length < 2) return false;
-                    var lastTurn = turns[turns.length - 1];
-                    var isAssistant = lastTurn.querySelector('.agent-turn') !== null;
-                    var hasCopy = lastTurn.querySelector('[data-testid="copy-turn-action-button"]') !== null;
-                    return isAssistant && hasCopy;
-                })()
-            ''')
-            if completed == True:
-                await tab.sleep(5)
-                print("✅ Deep Research 已完成 (检测到 assistant turn copy 按钮)")
+            if await run_pass(check_iframe_height=False):
                 return True
+        except BrowserFailure:
+            raise
         except Exception as e:
             print(f"⚠️ 检测错误: {e}")
+            if watchdog:
+                await watchdog.raise_if_failed(force=True)
             break
         await tab.sleep(config['timings']['button_check_interval'])
         elapsed += 1
@@ -350,48 +534,31 @@ def is_valid_markdown(md_path, min_length=200):
         return False
 
 
-async def _send_to_iframe_session(tab, session_id, method, params=None):
-    """通过 tab 的 websocket 发送带 sessionId 的 CDP 命令到 iframe session"""
-    ws = tab._websocket
-    the_id = next(tab.__count__)
-    message = {"id": the_id, "method": method, "sessionId": str(session_id)}
-    if params:
-        message["params"] = params
-    fut = asyncio.get_event_loop().create_future()
-    class _FakeTx:
-        def __init__(s): s.id = the_id; s._f = fut
-        def __call__(s, **r):
-            if "error" in r: s._f.set_exception(Exception(str(r["error"])))
-            else: s._f.set_result(r.get("result", {}))
-    tab.mapper[the_id] = _FakeTx()
-    await ws.send(json.dumps(message))
+async def _send_to_iframe_session(session, method, params=None, timeout=None):
+    """向 iframe 子会话发送 CDP 命令；出错或超时返回 None，由调用方决定是否走备选路径"""
     try:
-        return await asyncio.wait_for(fut, timeout=15)
-    except asyncio.TimeoutError:
-        tab.mapper.pop(the_id, None)
+        return await session.send(method, params, timeout=timeout)
+    except (CDPError, asyncio.TimeoutError, ConnectionError) as e:
+        print(f"⚠️ CDP: {method} 失败: {e!r}")
         return None
 
 
-async def extract_markdown_from_iframe(tab, config, md_path):
+async def extract_markdown_from_iframe(tab, config, md_path, download_dir=DOWNLOAD_DIR):
     """通过 CDP session 进入嵌套 iframe 提取内容并点击 Export 按钮"""
     try:
-        # 1. 找到外层 deep-research iframe target
-        targets = await tab.send(cdp_target.get_targets())
-        outer_tid = None
-        for t in targets:
-            if t.type_ == 'iframe' and 'deep_research' in (t.url or ''):
-                outer_tid = t.target_id
-                break
+        # 1. 找到本 tab 中的外层 deep-research iframe target
+        #    （同一会话中有多份报告时取最后一个，与 download_from_iframe 一致；其他 tab 的任务不会被选中）
+        outer_tid = await find_iframe_target(tab, 'deep_research')
         if not outer_tid:
             print("⚠️ CDP: 未找到 deep-research iframe target")
             return False
 
-        # 2. attach 到外层 iframe
-        outer_sid = await tab.send(cdp_target.attach_to_target(outer_tid, flatten=True))
-        print(f"  CDP: 已 attach 到外层 iframe, session={outer_sid}")
+        # 2. attach 到外层 iframe（同一 target 的会话在多次提取之间复用）
+        session = await get_session_client(tab).attach(str(outer_tid))
+        print(f"  CDP: 已 attach 到外层 iframe, session={session.session_id}")
 
         # 3. 获取外层 iframe 的 frame tree，找到内层 iframe#root
-        ft = await _send_to_iframe_session(tab, outer_sid, "Page.getFrameTree")
+        ft = await _send_to_iframe_session(session, "Page.getFrameTree")
         if not ft or 'frameTree' not in ft:
             print(f"⚠️ CDP: 获取 iframe frame tree 失败, ft={ft}")
             return False
@@ -405,23 +572,20 @@ async def extract_markdown_from_iframe(tab, config, md_path):
             print("⚠️ CDP: 未找到内层 iframe")
             return False
 
-        # 4. 在外层 session 中对内层 frame 创建 isolated world
-        ctx_result = await _send_to_iframe_session(tab, outer_sid, "Page.createIsolatedWorld", {
-            "frameId": inner_frame_id, "worldName": "extract_content"
-        })
-        if not ctx_result:
-            print("⚠️ CDP: 创建 isolated world 失败")
+        # 4. 在外层 session 中对内层 frame 创建（或复用）isolated world
+        try:
+            ctx_id = await session.isolated_world(inner_frame_id, "extract_content")
+        except (CDPError, asyncio.TimeoutError) as e:
+            print(f"⚠️ CDP: 创建 isolated world 失败: {e!r}")
             return False
-        ctx_id = ctx_result.get('executionContextId')
         print(f"  CDP: 内层 frame 执行上下文: {ctx_id}")
 
         # 5. 先尝试点击 Export 按钮下载原始 Markdown
-        download_dir = "/root/Downloads"
         Path(download_dir).mkdir(parents=True, exist_ok=True)
         for f in glob.glob(f"{download_dir}/*.md"):
             os.remove(f)
 
-        click_result = await _send_to_iframe_session(tab, outer_sid, "Runtime.evaluate", {
+        click_result = await _send_to_iframe_session(session, "Runtime.evaluate", {
             "expression": '''
                 (() => {
                     var buttons = document.querySelectorAll('button');
@@ -451,7 +615,7 @@ async def extract_markdown_from_iframe(tab, config, md_path):
                         return True
 
         # 6. Export 按钮失败，直接提取内容作为备选
-        text_result = await _send_to_iframe_session(tab, outer_sid, "Runtime.evaluate", {
+        text_result = await _send_to_iframe_session(session, "Runtime.evaluate", {
             "expression": '''
                 (() => {
                     // 优先提取 article/main/prose 等内容容器
@@ -489,9 +653,8 @@ async def extract_markdown_from_iframe(tab, config, md_path):
         return False
 
 
-async def download_from_iframe(tab, config, md_path):
+async def download_from_iframe(tab, config, md_path, download_dir=DOWNLOAD_DIR):
     """通过 CDP 坐标点击 iframe 内的下载按钮来获取 Markdown 文件"""
-    download_dir = "/root/Downloads"
     # 清空旧文件
     for f in glob.glob(f"{download_dir}/*.md"):
         os.remove(f)
@@ -606,11 +769,31 @@ def parse_arguments():
     parser.add_argument('--config', type=str, default='config.yaml',
                         help='配置文件路径 (默认: config.yaml)')
     parser.add_argument('--prompt_path', type=str, default=None,
-                        help='提示文件路径')
+                        help='提示文件路径；为 "-" 时从标准输入读取提示文本')
+    parser.add_argument('--name', type=str, default=None,
+                        help='输出子目录名 (默认: 提示文件名；从标准输入读取时为 "prompt")')
     parser.add_argument('--output_dir', type=str, default=None,
                         help='输出目录路径')
+    parser.add_argument('--conversation_url', type=str, default=None,
+                        help='在已有会话中继续提问（例如上一阶段的 url.txt）')
+    parser.add_argument('--resume_url', type=str, default=None,
+                        help='不提交提示，只等待该会话中已提交的研究完成并取回报告')
+    parser.add_argument('--record_cdp', type=str, default=None,
+                        help='把本次运行的 CDP 流量录制到指定的 JSONL 文件（供 cdp_replay.py 回放）')
+    parser.add_argument('--no_index', action='store_true',
+                        help='不更新报告索引（结果目录是临时目录时使用，例如分布式 worker）')
     return parser.parse_args()
 
 if __name__ == "__main__":
     args = parse_arguments()
-    uc.loop().run_until_complete(main(config_path=args.config, prompt_path=args.prompt_path, output_dir=args.output_dir))
+    # 被 `progress.py stop` 等终止时正常退出，让 nodriver 的 atexit 清理关闭浏览器
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    prompt_text = None
+    if args.prompt_path == '-':
+        prompt_text = sys.stdin.buffer.read().decode('utf-8')
+        args.prompt_path = None
+    uc.loop().run_until_complete(main(config_path=args.config, prompt_path=args.prompt_path,
+                                      output_dir=args.output_dir, record_cdp=args.record_cdp,
+                                      prompt_text=prompt_text, name=args.name,
+                                      conversation_url=args.conversation_url,
+                                      index=not args.no_index, resume_url=args.resume_url))
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""CDP 录制/回放：下载目录中出现的文件随录制保存，回放时在同一位置还原，控制流与录制时一致"""
+
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import nodriver as uc  # noqa: E402
+
+import run_DeepResearch as dr  # noqa: E402
+from cdp_replay import CDPRecorder, CDPReplayer, ReplayMismatch, load_log  # noqa: E402
+
+FIXTURES = Path(__file__).parent / "fixtures"
+# 第一个坐标点击就下载成功的 download_from_iframe 录制
+DOWNLOAD_LOG = FIXTURES / "download_first_click.jsonl"
+REPORT = "# Report\n\n" + "Deep research findings. " * 20 + "\n"
+IFRAME_RECT = {"x": 100, "y": 0, "width": 680, "height": 900}
+
+
+class ScriptedTab(uc.Tab):
+    """按 CDP 方法应答的假 tab：第 click_on 次松开鼠标时把报告写入下载目录（模拟浏览器下载完成）"""
+
+    def __init__(self, download_dir, click_on=1):
+        uc.Tab.__init__(self, websocket_url="ws://scripted", target=None, browser=None)
+        self.download_dir = Path(download_dir)
+        self.click_on = click_on
+        self.clicks = 0
+
+    def respond(self, request):
+        method, params = request["method"], request.get("params") or {}
+        if method == "Runtime.evaluate":
+            if "getBoundingClientRect" in params["expression"]:
+                value = json.dumps(IFRAME_RECT)
+                return {"result": {"type": "string", "value": value,
+                                   "deepSerializedValue": {"type": "string", "value": value}}}
+            return {"result": {"type": "undefined"}}
+        if method == "Input.dispatchMouseEvent" and params.get("type") == "mouseReleased":
+            self.clicks += 1
+            if self.clicks == self.click_on:
+                self.download_dir.mkdir(parents=True, exist_ok=True)
+                (self.download_dir / "report.md").write_text(REPORT, encoding="utf-8")
+        return {}
+
+    async def send(self, cdp_obj, *args, **kwargs):
+        raw = self.respond(next(cdp_obj))
+        try:
+            cdp_obj.send(raw)
+        except StopIteration as e:
+            return e.value
+
+    async def sleep(self, t=1):
+        await asyncio.sleep(0)
+
+
+def record_download(log_path, download_dir, md_path, click_on=1):
+    """用 CDPRecorder 录制一次 download_from_iframe，返回其结果"""
+    recorder = CDPRecorder(log_path, download_dir=download_dir)
+    try:
+        tab = recorder.attach(ScriptedTab(download_dir, click_on=click_on))
+        return asyncio.run(dr.download_from_iframe(tab, {}, md_path, str(download_dir)))
+    finally:
+        recorder.close()
+
+
+def replay_download(log_path, download_dir, md_path):
+    replayer = CDPReplayer(log_path, download_dir=download_dir)
+    tab = replayer.make_tab()
+    downloaded = asyncio.run(dr.download_from_iframe(tab, {}, md_path, str(download_dir)))
+    return downloaded, replayer.report(0)
+
+
+def test_fixture_replays_download_branch(tmp_path):
+    downloaded, report = replay_download(DOWNLOAD_LOG, tmp_path / "downloads", tmp_path / "output.md")
+    assert downloaded
+    assert (tmp_path / "output.md").read_text(encoding="utf-8") == REPORT
+    assert report["unconsumed_commands"] == 0
+    assert report["replayed"]["downloads"] == report["recorded"]["downloads"] == 1
+    assert report["replayed"]["commands"] == report["recorded"]["commands"]
+
+
+def test_replay_without_download_dir_diverges(tmp_path):
+    # 还原不了下载文件时代码会继续尝试下一个点击位置，与录制不一致
+    with pytest.raises(ReplayMismatch):
+        replay_download(DOWNLOAD_LOG, None, tmp_path / "output.md")
+
+
+@pytest.mark.parametrize("click_on", [1, 3])
+def test_record_then_replay(tmp_path, click_on):
+    log_path = tmp_path / "cdp.jsonl"
+    assert record_download(log_path, tmp_path / "recorded", tmp_path / "recorded.md", click_on=click_on)
+    files = [e for e in load_log(log_path) if e["k"] == "file"]
+    assert [(e["n"], e["c"]) for e in files] == [("report.md", REPORT)]
+
+    downloaded, report = replay_download(log_path, tmp_path / "replayed", tmp_path / "replayed.md")
+    assert downloaded
+    assert (tmp_path / "replayed.md").read_text(encoding="utf-8") == REPORT
+    assert report["unconsumed_commands"] == 0
+    assert report["replayed"]["sleeps"] == report["recorded"]["sleeps"]
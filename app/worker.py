@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""分布式模式的 worker：从协调器租取任务，运行 run_DeepResearch.py，运行期间持续心跳，结束后上传结果"""
+
+import argparse
+import json
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+from coordinator import RESULT_FILES, is_conversation_url
+from run_DeepResearch import sanitize_path
+
+
+class LeaseLost(Exception):
+    """协调器已收回租约（过期后重新租给了别的 worker）"""
+
+
+class CoordinatorClient:
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _post(self, path, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        req = urllib.request.Request(self.base_url + path, data=data,
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return json.loads(resp.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            if e.code == 409:
+                raise LeaseLost(path)
+            raise
+
+    def lease(self, worker):
+        return self._post("/lease", {"worker": worker})
+
+    def heartbeat(self, job, url=None):
+        payload = {"job_id": job["id"], "lease_id": job["lease_id"]}
+        if url:
+            payload["url"] = url
+        return self._post("/heartbeat", payload)
+
+    def complete(self, job, status, files, error=None):
+        return self._post("/complete", {"job_id": job["id"], "lease_id": job["lease_id"],
+                                        "status": status, "files": files, "error": error})
+
+
+def collect_results(output_dir):
+    """读取本地输出目录中的结果文件，返回 (status, files)"""
+    files = {}
+    for filename in RESULT_FILES:
+        path = Path(output_dir) / filename
+        if path.exists():
+            files[filename] = path.read_text(encoding="utf-8", errors="replace")
+    status = "worker_error"
+    if "meta.json" in files:
+        try:
+            status = json.loads(files["meta.json"]).get("status") or status
+        except json.JSONDecodeError:
+            pass
+    return status, files
+
+
+def read_conversation_url(output_dir):
+    """run_DeepResearch 提交后写入的会话 URL；尚未写入时返回 None"""
+    try:
+        url = (Path(output_dir) / "url.txt").read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    return url if is_conversation_url(url) else None
+
+
+def upload_results(client, job, status, files, error, interval):
+    """上传结果；协调器暂时不可达时按指数退避重试，期间继续心跳保持租约。
+    租约失效时抛出 LeaseLost（协调器会带着会话 URL 重新排队，不会再次提交）"""
+    delay = 1
+    while True:
+        try:
+            return client.complete(job, status, files, error)
+        except (urllib.error.URLError, OSError) as e:
+            print(f"⚠️ 上传结果失败，{delay:.0f} 秒后重试: {e}")
+        time.sleep(delay)
+        delay = min(delay * 2, interval)
+        try:
+            client.heartbeat(job, files.get("url.txt"))
+        except (urllib.error.URLError, OSError):
+            pass
+
+
+def run_job(client, job, work_dir, config_path, lease_ttl):
+    """运行单个任务：子进程执行 run_DeepResearch.py，主线程每 lease_ttl/3 秒心跳一次。
+    会话 URL 写入后随心跳上报，任务带 resume_url 时只继续等待该会话而不重新提交"""
+    job_dir = Path(work_dir) / sanitize_path(job["id"])
+    shutil.rmtree(job_dir, ignore_errors=True)
+    job_dir.mkdir(parents=True)
+    prompt_file = job_dir / f"{sanitize_path(job['name'])}.txt"
+    prompt_file.write_text(job["prompt"], encoding="utf-8")
+    output_dir = job_dir / sanitize_path(prompt_file.stem)
+
+    # 结果上传后由协调器写入索引；这里的临时目录随后会被删除，不能进入索引
+    cmd = [sys.executable, 'run_DeepResearch.py', '--config', str(config_path),
+           '--prompt_path', str(prompt_file), '--output_dir', str(job_dir), '--no_index']
+    if job.get("resume_url"):
+        cmd += ['--resume_url', job["resume_url"]]
+    proc = subprocess.Popen(cmd)
+    interval = max(1, lease_ttl / 3)
+    error = None
+    reported_url = None
+    try:
+        while True:
+            try:
+                proc.wait(timeout=interval)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            url = read_conversation_url(output_dir)
+            try:
+                client.heartbeat(job, url if url != reported_url else None)
+                reported_url = url
+            except LeaseLost:
+                print(f"⚠️ 租约已失效，放弃任务: {job['name']}")
+                proc.terminate()
+                proc.wait()
+                return None
+            except (urllib.error.URLError, OSError) as e:
+                # 协调器暂时不可达时继续运行，租约 TTL 内恢复即可
+                print(f"⚠️ 心跳失败: {e}")
+    except BaseException:
+        proc.terminate()
+        proc.wait()
+        raise
+
+    status, files = collect_results(output_dir)
+    if proc.returncode != 0:
+        error = f"run_DeepResearch.py exited with {proc.returncode}"
+    try:
+        result = upload_results(client, job, status, files, error, interval)
+    except LeaseLost:
+        print(f"⚠️ 上传结果时租约已失效: {job['name']}")
+        return None
+    shutil.rmtree(job_dir, ignore_errors=True)
+    return status, result
+
+
+def worker_loop(client, worker_name, work_dir, config_path, poll_interval, exit_when_idle, stop):
+    while not stop.is_set():
+        try:
+            reply = client.lease(worker_name)
+        except (urllib.error.URLError, OSError) as e:
+            print(f"⚠️ 无法连接协调器: {e}")
+            stop.wait(poll_interval)
+            continue
+        job = reply.get("job")
+        if job is None:
+            if exit_when_idle and reply.get("drained"):
+                return
+            stop.wait(poll_interval)
+            continue
+        print(f"▶️ 开始处理: {job['batch']}/{job['name']}")
+        try:
+            outcome = run_job(client, job, work_dir, config_path, reply.get("lease_ttl", 120))
+        except Exception as e:
+            print(f"⚠️ 处理 {job['name']} 时出错: {e}")
+            try:
+                client.complete(job, "worker_error", {}, str(e))
+            except Exception:
+                pass
+            continue
+        if outcome:
+            status, _ = outcome
+            print(f"✅ 处理完成: {job['name']} ({status})")
+        print("----------------------------------------")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='分布式 Deep Research worker')
+    parser.add_argument('--coordinator', required=True,
+                        help='协调器地址，例如 http://192.168.1.10:8765')
+    parser.add_argument('--config', type=str, default='config.yaml',
+                        help='配置文件路径 (默认: config.yaml)')
+    parser.add_argument('--work_dir', type=str, default='/tmp/deep_research_worker',
+                        help='本地临时输出目录 (默认: /tmp/deep_research_worker)')
+    parser.add_argument('--slots', type=int, default=1,
+                        help='本机同时运行的任务数 (默认: 1)')
+    parser.add_argument('--interval', type=int, default=10,
+                        help='各 slot 启动间隔 / 空闲时轮询间隔（秒）(默认: 10)')
+    parser.add_argument('--name', type=str, default=socket.gethostname(),
+                        help='worker 名称 (默认: 主机名)')
+    parser.add_argument('--exit-when-idle', action='store_true',
+                        help='队列清空后退出')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    client = CoordinatorClient(args.coordinator)
+    stop = threading.Event()
+    threads = []
+    print(f"🛠️ worker {args.name} 已启动: {args.slots} 个 slot -> {args.coordinator}")
+    for slot in range(args.slots):
+        t = threading.Thread(target=worker_loop, daemon=True,
+                             args=(client, f"{args.name}#{slot}", Path(args.work_dir) / str(slot),
+                                   args.config, args.interval, args.exit_when_idle, stop))
+        t.start()
+        threads.append(t)
+        if slot < args.slots - 1:
+            time.sleep(args.interval)
+    try:
+        while any(t.is_alive() for t in threads):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop.set()
+        print("🛑 正在停止，未完成的任务将在租约过期后由其他 worker 重新执行")
+
+
+if __name__ == "__main__":
+    main()